@@ -0,0 +1,82 @@
+"""
+Compare the lxml and BeautifulSoup article extractors on saved pages.
+
+    python benchmarks/bench_extract.py saved/*.html
+    python benchmarks/bench_extract.py --images 400    # synthetic image-heavy page
+    python benchmarks/bench_extract.py --url https://elpais.com/a.html saved/elpais-*.html
+
+The --url option sets the address the pages are parsed as, so the lxml engine applies that site's
+extraction rules.
+
+Pages are read as raw bytes, as they come off the network. Image size checks are skipped so only
+parsing and traversal are measured. Differences between the two outputs are reported per page;
+captions are expected to differ where the old extractor picked up another figure's caption.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapper import extract_content_bs4, extract_content_lxml
+
+BASE_URL = 'https://example.com/news/article.html'
+
+def synthetic_page(images, paragraphs_per_image=3):
+    """
+    An article with the given number of captioned figures, each followed by a few paragraphs.
+    """
+    parts = ['<html><head><meta charset="utf-8"><title>Test</title></head><body><article><h1>Headline</h1>']
+    for i in range(images):
+        parts.append(f'<figure><img src="/images/{i}.jpg" alt="Image {i}"><figcaption>Caption {i}</figcaption></figure>')
+        for j in range(paragraphs_per_image):
+            parts.append(f'<p>Paragraph {i}.{j} with <a href="/link/{j}">a link</a> and some text.</p>')
+    parts.append('</article></body></html>')
+    return ''.join(parts).encode('utf-8')
+
+def keep_all(src):
+    return True
+
+def measure(func, data, url, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(data, url, keep_image=keep_all)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def compare(name, data, url, repeat):
+    bs4_time, bs4_content = measure(extract_content_bs4, data, url, repeat)
+    lxml_time, lxml_content = measure(extract_content_lxml, data, url, repeat)
+    same = [item for item in lxml_content if item in bs4_content]
+    print(f"{name}: {len(data) / 1024:.0f} KB, bs4 {bs4_time * 1000:.1f} ms, lxml {lxml_time * 1000:.1f} ms "
+          f"({bs4_time / lxml_time:.1f}x), {len(lxml_content)} blocks, {len(same)}/{len(bs4_content)} identical")
+    return bs4_time, lxml_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the article extractors")
+    parser.add_argument("pages", nargs='*', help="Saved HTML pages")
+    parser.add_argument("--images", type=int, default=200, help="Figures in the synthetic page when no pages are given")
+    parser.add_argument("--url", default=BASE_URL, help="URL the pages are parsed as")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per page; the best time is kept")
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, 'rb') as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [(f"synthetic-{count}", synthetic_page(count)) for count in (args.images // 4, args.images // 2, args.images)]
+
+    total_bs4 = total_lxml = 0
+    for name, data in pages:
+        bs4_time, lxml_time = compare(name, data, args.url, args.repeat)
+        total_bs4 += bs4_time
+        total_lxml += lxml_time
+    print(f"Total: bs4 {total_bs4:.2f}s, lxml {total_lxml:.2f}s ({total_bs4 / total_lxml:.1f}x)")
+
+if __name__ == "__main__":
+    main()
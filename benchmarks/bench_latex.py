@@ -0,0 +1,79 @@
+"""
+Check that writing the LaTeX digest takes time and space linear in the number of articles.
+
+    python benchmarks/bench_latex.py
+    python benchmarks/bench_latex.py --sources 1 2 4 8 --articles 25
+
+Synthetic articles are spread over an increasing number of sources and written to a temporary
+.tex file (xelatex is not run). The script exits with status 1 if the time or size per article
+grows with the document, as it did when every source was written once per source.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_generator_latex import write_latex_document
+
+PARAGRAPH = ("The council approved the budget on Tuesday after a long debate about transport, housing "
+             "and the 50% increase in energy costs, which officials blamed on the winter & supply issues.")
+
+def make_articles(sources, articles_per_source, paragraphs=8):
+    articles_by_source = {}
+    for s in range(sources):
+        articles_by_source[f"Source_{s}"] = [{
+            'title': f"Article {s}.{a}: budget & transport",
+            'pubDate': 'Tue, 05 Nov 2024 10:00:00 +0000',
+            'full_content': [('text', PARAGRAPH)] * paragraphs + [('image', {'url': f"https://example.com/{s}/{a}.jpg", 'caption': 'A caption'})]
+        } for a in range(articles_per_source)]
+    return articles_by_source
+
+def measure(articles_by_source, image_paths, repeat):
+    best = None
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'bench.tex')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with open(path, 'w', encoding='utf-8') as tex_file:
+                write_latex_document(tex_file, articles_by_source, None, image_paths=image_paths)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        size = os.path.getsize(path)
+    return best, size
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that LaTeX generation is linear in the number of articles")
+    parser.add_argument("--sources", type=int, nargs='+', default=[1, 2, 4, 8, 16], help="Source counts to measure")
+    parser.add_argument("--articles", type=int, default=50, help="Articles per source")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size; the best time is kept")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="Allowed growth of the time per article")
+    args = parser.parse_args()
+
+    rows = []
+    for sources in args.sources:
+        articles_by_source = make_articles(sources, args.articles)
+        # Images are already prepared, so nothing is downloaded
+        image_paths = {item['url']: f"/tmp/{i}.jpg" for i, item in enumerate(
+            item for articles in articles_by_source.values() for article in articles
+            for item_type, item in article['full_content'] if item_type == 'image')}
+        elapsed, size = measure(articles_by_source, image_paths, args.repeat)
+        count = sources * args.articles
+        rows.append((count, elapsed, size))
+        print(f"{sources:3d} sources, {count:5d} articles: {elapsed * 1000:8.1f} ms, {size / 1024:8.0f} KB, "
+              f"{elapsed / count * 1e6:6.1f} us and {size / count:6.0f} bytes per article")
+
+    first_count, first_time, first_size = rows[0]
+    last_count, last_time, last_size = rows[-1]
+    time_growth = (last_time / last_count) / (first_time / first_count)
+    size_growth = (last_size / last_count) / (first_size / first_count)
+    print(f"Per-article time grew {time_growth:.2f}x and size {size_growth:.2f}x from {first_count} to {last_count} articles")
+    if time_growth > args.tolerance or size_growth > 1.1:
+        print("Generation is not linear in the number of articles")
+        sys.exit(1)
+    print("OK: generation is linear in the number of articles")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+CACHE_DIR = 'cache'
+CACHE_DB = os.path.join(CACHE_DIR, 'remarknews.sqlite3')
+ACCESS_RESOLUTION = 3600  # Seconds; a read refreshes an entry's last access time at most this often
+
+class Cache:
+    """
+    Persistent key/value store backed by an SQLite table, shared across runs.
+    Values are pickled. Entries older than ttl seconds are ignored and removed, and the least
+    recently used entries are evicted once the table holds more than max_size bytes.
+    """
+    def __init__(self, name, ttl=None, max_size=None, path=CACHE_DB):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Connect lazily so importing a module that declares a cache has no side effects
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.name}" ('
+                'key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)'
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key, default=None):
+        """
+        Return the value stored under key, or default if it is missing or expired.
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(f'SELECT value, created, accessed FROM "{self.name}" WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return default
+            value, created, accessed = row
+            now = time.time()
+            if self.ttl is not None and now - created > self.ttl:
+                conn.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+                conn.commit()
+                return default
+            # The access time only matters for LRU eviction, and an hour's precision is enough for it,
+            # so most reads do not write
+            if self.max_size is not None and now - accessed > ACCESS_RESOLUTION:
+                conn.execute(f'UPDATE "{self.name}" SET accessed = ? WHERE key = ?', (now, key))
+                conn.commit()
+        try:
+            return pickle.loads(value)
+        except Exception as e:
+            print(f"Error reading cache entry {key} from {self.name}: {e}")
+            return default
+
+    def set(self, key, value, size=None):
+        """
+        Store value under key, then evict old entries if the cache is over its limits.
+        size is the number of bytes the entry accounts for (defaults to the pickled value's size).
+        Returns the list of evicted keys.
+        """
+        data = pickle.dumps(value)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f'INSERT OR REPLACE INTO "{self.name}" (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, data, len(data) if size is None else size, now, now)
+            )
+            conn.commit()
+        return self.evict()
+
+    def delete(self, key):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+            conn.commit()
+
+    def evict(self):
+        """
+        Remove expired entries and, if needed, the least recently used ones until under max_size.
+        Returns the list of evicted keys.
+        """
+        evicted = []
+        with self._lock:
+            conn = self._connect()
+            if self.ttl is not None:
+                threshold = time.time() - self.ttl
+                rows = conn.execute(f'SELECT key FROM "{self.name}" WHERE created < ?', (threshold,)).fetchall()
+                evicted.extend(key for key, in rows)
+                conn.execute(f'DELETE FROM "{self.name}" WHERE created < ?', (threshold,))
+            if self.max_size is not None:
+                total = conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM "{self.name}"').fetchone()[0]
+                if total > self.max_size:
+                    for key, size in conn.execute(f'SELECT key, size FROM "{self.name}" ORDER BY accessed').fetchall():
+                        if total <= self.max_size:
+                            break
+                        conn.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+                        evicted.append(key)
+                        total -= size
+            conn.commit()
+        return evicted
+
+class RunMemo:
+    """
+    In-memory memo for the current run: each key is computed once, even when several
+    threads ask for it at the same time. Later callers wait for the first one's result.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get_or_compute(self, key, func, *args):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+        if owner:
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._futures
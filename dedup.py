@@ -0,0 +1,164 @@
+import re
+import threading
+import zlib
+import numpy as np
+
+SHINGLE_SIZE = 5  # Words per shingle
+NUM_PERM = 64  # MinHash signature length
+BANDS = 16  # LSH bands of NUM_PERM // BANDS rows; pairs sharing a band are compared
+DUPLICATE_THRESHOLD = 0.6  # Estimated Jaccard similarity above which two articles are the same story
+MIN_WORDS = 50  # Shorter texts (feed descriptions, failed extractions) are never clustered
+POLICIES = ['off', 'drop', 'longest', 'xref']
+
+WORD_RE = re.compile(r'\w+')
+
+# Multiply-shift hash functions, one per signature position, fixed so signatures are comparable across runs
+_rng = np.random.default_rng(20240905)
+_A = _rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+
+def article_text(article):
+    return ' '.join(item for kind, item in article.get('full_content') or [] if kind == 'text')
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Return the hashes of the overlapping word n-grams of a text, or None if it is too short.
+    """
+    words = WORD_RE.findall(text.lower())
+    if len(words) < max(MIN_WORDS, size):
+        return None
+    return np.unique(np.array([zlib.crc32(' '.join(words[i:i + size]).encode('utf-8'))
+                               for i in range(len(words) - size + 1)], dtype=np.uint64))
+
+def minhash(hashes):
+    """
+    MinHash signature of a set of shingle hashes.
+    """
+    with np.errstate(over='ignore'):
+        values = (_A[:, None] * hashes[None, :] + _B[:, None]) >> np.uint64(32)
+    return values.min(axis=1)
+
+def similarity(signature, other):
+    """
+    Estimated Jaccard similarity of the shingle sets behind two signatures.
+    """
+    return float(np.mean(signature == other))
+
+def duplicate_note(duplicate_of):
+    """
+    Text of the note replacing a story already covered by another source; renderers escape it for their format.
+    """
+    return f"Same story as “{duplicate_of['title']}” in {duplicate_of['source']}."
+
+class Deduplicator:
+    """
+    Cluster near-duplicate articles across all sources of a run with MinHash signatures and an LSH index.
+    Articles are added as they are extracted; each call returns the articles that can move on, as
+    (key, article) pairs where article is None for a dropped duplicate. Policies:
+
+    - drop: the first version of a story is kept, later ones are dropped
+    - xref: later versions lose their content and get article['duplicate_of'] (source, title and link
+      of the first one), which the renderers turn into a note
+    - longest: articles are held until flush() and only the longest version of each story is kept
+    - off: articles are passed through unchanged
+
+    With drop and xref, "first" means first extracted, so which source keeps a story depends on
+    fetch timing. longest does not depend on timing: equal lengths go to the earlier source in
+    sources, then to the earlier article.
+    """
+    def __init__(self, policy='xref', threshold=DUPLICATE_THRESHOLD, bands=BANDS, sources=()):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown duplicate policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.threshold = threshold
+        self.bands = bands
+        self._source_rank = {name: rank for rank, name in enumerate(sources)}
+        self._lock = threading.Lock()
+        self._buckets = {}  # (band, band bytes) -> indexes of the indexed articles
+        self._signatures = []
+        self._entries = []  # (key, source name, article, text length) per indexed article
+        self._parent = []  # Union-find over the indexed articles, for the longest policy
+        self._held = []  # (key, article) of unindexed articles held by the longest policy
+        self.duplicates = 0
+
+    def _find_match(self, signature):
+        rows = len(signature) // self.bands
+        candidates = set()
+        for band in range(self.bands):
+            candidates.update(self._buckets.get((band, signature[band * rows:(band + 1) * rows].tobytes()), ()))
+        best, best_score = None, self.threshold
+        for index in candidates:
+            score = similarity(signature, self._signatures[index])
+            if score >= best_score:
+                best, best_score = index, score
+        return best
+
+    def _index(self, signature, entry):
+        index = len(self._signatures)
+        rows = len(signature) // self.bands
+        for band in range(self.bands):
+            self._buckets.setdefault((band, signature[band * rows:(band + 1) * rows].tobytes()), []).append(index)
+        self._signatures.append(signature)
+        self._entries.append(entry)
+        self._parent.append(index)
+        return index
+
+    def _root(self, index):
+        while self._parent[index] != index:
+            self._parent[index] = self._parent[self._parent[index]]
+            index = self._parent[index]
+        return index
+
+    def add(self, key, source_name, article):
+        if self.policy == 'off' or article is None:
+            return [(key, article)]
+        text = article_text(article)
+        hashes = shingles(text)
+        with self._lock:
+            if hashes is None:
+                if self.policy == 'longest':
+                    self._held.append((key, article))
+                    return []
+                return [(key, article)]
+            signature = minhash(hashes)
+            match = self._find_match(signature)
+
+            if self.policy == 'longest':
+                index = self._index(signature, (key, source_name, article, len(text)))
+                if match is not None:
+                    self._parent[self._root(index)] = self._root(match)
+                    self.duplicates += 1
+                return []
+
+            if match is None:
+                self._index(signature, (key, source_name, article, len(text)))
+                return [(key, article)]
+            self.duplicates += 1
+            if self.policy == 'drop':
+                return [(key, None)]
+            _, original_source, original, _ = self._entries[match]
+            article['duplicate_of'] = {'source': original_source, 'title': original.get('title', ''), 'link': original.get('link', '')}
+            article['full_content'] = []
+            return [(key, article)]
+
+    def flush(self):
+        """
+        Release the articles held by the longest policy, keeping the longest article of each cluster.
+        """
+        def rank(index):
+            key, source_name, _, length = self._entries[index]
+            return (-length, self._source_rank.get(source_name, len(self._source_rank)), key)
+
+        with self._lock:
+            longest = {}
+            for index in range(len(self._entries)):
+                root = self._root(index)
+                if root not in longest or rank(index) < rank(longest[root]):
+                    longest[root] = index
+            kept = set(longest.values())
+            released = self._held
+            if self.policy == 'longest':
+                released = released + [(key, article if index in kept else None)
+                                        for index, (key, _, article, _) in enumerate(self._entries)]
+            self._held = []
+            return released
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image, ImageOps
+from image_store import fetch_image, add_variant
+
+SCREEN_SIZE = (1404, 1872)  # reMarkable display in pixels
+COLUMN_SIZE = (700, 935)  # One column of the two-column PDF layout at the tablet's resolution
+JPEG_QUALITY = 70
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Return the shared process pool used to transcode images, creating it on first use.
+    Workers are spawned rather than forked because the pipeline runs several threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def variant_path(path, max_size, dither):
+    """
+    Path of the e-ink version of a stored image. It lives next to the original and starts with the same
+    content hash, so it is removed together with it when the image store evicts the original.
+    """
+    base, _ = os.path.splitext(path)
+    mode = 'dither' if dither else 'gray'
+    ext = '.png' if dither else '.jpg'
+    return f"{base}.eink-{max_size[0]}x{max_size[1]}-{mode}{ext}"
+
+def transcode_image(path, max_size=SCREEN_SIZE, dither=False):
+    """
+    Downscale an image to fit max_size, convert it to grayscale and re-encode it compactly.
+    Dithered images are stored as 1-bit PNG, the others as JPEG. Returns the path of the new image.
+    """
+    output_path = variant_path(path, max_size, dither)
+    if os.path.exists(output_path):
+        return output_path
+
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white paper instead of black
+            img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img)
+        img = img.convert('L')
+        img.thumbnail(max_size, Image.LANCZOS)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if dither:
+                    img.convert('1').save(f, 'PNG', optimize=True)
+                else:
+                    img.save(f, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(temp_path, output_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+    return output_path
+
+def prepare_images(urls, max_size=SCREEN_SIZE, dither=False):
+    """
+    Download the given image URLs through the image store and transcode them for e-ink in parallel.
+    Returns a dict mapping each URL to a local path, or to None if the image could not be downloaded.
+    Images that fail to transcode keep their original file.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = dict(zip(urls, executor.map(fetch_image, urls)))
+
+    pool = get_pool()
+    futures = {url: pool.submit(transcode_image, path, max_size, dither) for url, path in paths.items() if path}
+    for url, future in futures.items():
+        try:
+            variant = future.result()
+            # Variants count towards the size limit of the image store
+            add_variant(paths[url], variant)
+            paths[url] = variant
+        except Exception as e:
+            print(f"Error transcoding image {url}: {e}")
+    return paths
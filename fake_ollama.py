@@ -0,0 +1,229 @@
+"""
+A small stand-in for the Ollama HTTP API, used to exercise the summarizer offline.
+
+It answers /api/chat and /api/generate with a canned bullet-point summary, streamed one token at a
+time with a configurable delay, and keeps track of how many requests were in flight at once.
+Like Ollama, it pays a load delay when the model is not loaded (the first request, or after
+keep_alive 0), and only evaluates the part of the prompt that differs from the previous request.
+
+Run it directly to measure the SummaryEngine's throughput and timeout handling:
+
+    python fake_ollama.py --articles 8 --in-flight 2 --token-delay 0.01
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SUMMARY = "- The article describes an event.\n- It gives some context.\n- It ends with an outlook."
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_error(400, 'Invalid JSON')
+            return
+        if self.path not in ('/api/generate', '/api/chat'):
+            self.send_error(404)
+            return
+        self.server.request_started()
+        try:
+            self.stream_response(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled or timed out
+            pass
+        finally:
+            self.server.request_finished()
+
+    def stream_response(self, body):
+        server = self.server
+        chat = self.path == '/api/chat'
+        if chat:
+            prompt = ''.join(message.get('content', '') for message in body.get('messages', []))
+        else:
+            prompt = body.get('prompt', '')
+
+        load_duration = server.load(body.get('model'), body.get('keep_alive'))
+        prompt_tokens = server.prefill(prompt)
+        timings = {'load_duration': load_duration, 'prompt_eval_count': prompt_tokens,
+                   'prompt_eval_duration': int(prompt_tokens * server.prompt_token_delay * 1e9)}
+
+        if not prompt:
+            # A request without a prompt only loads (or unloads) the model
+            self.send_json({'model': body.get('model'), 'response': '', 'done': True, **timings})
+            return
+
+        tokens = server.summary.split(' ')
+        tokens = [token + ' ' for token in tokens[:-1]] + tokens[-1:]
+        num_predict = body.get('options', {}).get('num_predict')
+        if num_predict:
+            tokens = tokens[:num_predict]
+        stream = body.get('stream', True)
+        started = time.monotonic()
+
+        def piece(text, done):
+            if chat:
+                return {'model': body.get('model'), 'message': {'role': 'assistant', 'content': text}, 'done': done}
+            return {'model': body.get('model'), 'response': text, 'done': done}
+
+        if not stream:
+            time.sleep(server.token_delay * len(tokens))
+            self.send_json({**piece(''.join(tokens), True), **timings,
+                            'eval_count': len(tokens), 'eval_duration': int((time.monotonic() - started) * 1e9)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in tokens:
+            time.sleep(server.token_delay)
+            self.write_chunk(piece(token, False))
+        self.write_chunk({**piece('', True), **timings,
+                          'eval_count': len(tokens), 'eval_duration': int((time.monotonic() - started) * 1e9)})
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, data):
+        payload = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """
+    Ollama-compatible server running in a background thread. Use it as a context manager;
+    the base URL to give the summarizer is in the url attribute.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, token_delay=0.01, load_delay=0.0, prompt_token_delay=0.0, summary=DEFAULT_SUMMARY):
+        super().__init__(('127.0.0.1', port), FakeOllamaHandler)
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.summary = summary
+        self.loaded_model = None
+        self.cached_prompt = ''
+        self._model_lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._counter_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def request_started(self):
+        with self._counter_lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self):
+        with self._counter_lock:
+            self.in_flight -= 1
+
+    def load(self, model, keep_alive=None):
+        """
+        Simulate loading the model. Returns the load duration in nanoseconds.
+        """
+        with self._model_lock:
+            if keep_alive in (0, '0', '0s', '0m'):
+                self.loaded_model = None
+                self.cached_prompt = ''
+                return 0
+            if self.loaded_model == model:
+                return 0
+            time.sleep(self.load_delay)
+            self.loaded_model = model
+            self.cached_prompt = ''
+            return int(self.load_delay * 1e9)
+
+    def prefill(self, prompt):
+        """
+        Simulate evaluating a prompt, reusing the prefix shared with the previous one.
+        Returns the number of tokens (here, characters / 4) that had to be evaluated.
+        """
+        with self._model_lock:
+            shared = 0
+            for a, b in zip(prompt, self.cached_prompt):
+                if a != b:
+                    break
+                shared += 1
+            self.cached_prompt = prompt
+        tokens = (len(prompt) - shared) // 4
+        time.sleep(tokens * self.prompt_token_delay)
+        return tokens
+
+    def handle_error(self, request, client_address):
+        # Clients drop keep-alive connections when they stop reading a stream early
+        pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    from summarizer import SummaryEngine, summary_cache_key, summary_cache
+
+    parser = argparse.ArgumentParser(description="Measure the summarizer against a fake Ollama server")
+    parser.add_argument("--articles", type=int, default=8, help="Number of articles to summarize")
+    parser.add_argument("--in-flight", type=int, default=2, help="Concurrent requests allowed by the engine")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    with FakeOllamaServer(token_delay=args.token_delay, load_delay=0.5, prompt_token_delay=0.0005) as server:
+        engine = SummaryEngine('fake-model', base_url=server.url, max_in_flight=args.in_flight, timeout=args.timeout)
+        engine.warm_up()
+        texts = [f"Offline benchmark article {i} {time.time()}" for i in range(args.articles)]
+        started = time.monotonic()
+        summaries = engine.summarize_many(texts)
+        elapsed = time.monotonic() - started
+        for text in texts:
+            summary_cache.delete(summary_cache_key(text, engine.model))
+
+        stats = engine.stats()
+        print(f"Summarized {sum(1 for summary in summaries if summary)}/{len(texts)} articles in {elapsed:.2f}s")
+        print(f"Max requests in flight: {server.max_in_flight} (limit {args.in_flight})")
+        print(f"Throughput: {stats['tokens_per_second']:.1f} tokens/s per request, {stats['tokens'] / elapsed:.1f} tokens/s overall")
+        print(f"Model load {stats['load_seconds']:.2f}s (during warm-up), prompt evaluation {stats['prompt_tokens']} tokens in {stats['prompt_seconds']:.2f}s")
+        engine.release()
+
+        # A server slower than the timeout must not block the engine
+        server.token_delay = args.timeout
+        slow_engine = SummaryEngine('fake-model', base_url=server.url, max_in_flight=1, timeout=args.timeout / 2)
+        started = time.monotonic()
+        result = slow_engine.summarize(f"Slow article {time.time()}")
+        print(f"Slow request returned {result!r} after {time.monotonic() - started:.2f}s (timeout {args.timeout / 2}s)")
+
+if __name__ == "__main__":
+    main()
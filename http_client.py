@@ -0,0 +1,104 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (5, 20)  # (connect, read) seconds
+MAX_RESPONSE_SIZE = 20 * 1024 * 1024  # 20 MB
+POOL_SIZE = 16  # Hosts kept in the pool, and keep-alive connections per host
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+USER_AGENT = 'Mozilla/5.0'
+
+_session = None
+_session_lock = threading.Lock()
+
+class ResponseTooLarge(requests.RequestException):
+    """
+    Raised when a response body exceeds the allowed size.
+    """
+
+def classify_error(error):
+    """
+    Return the failure class of a request error: 'timeout', 'connection', 'too_large', 'blocked'
+    (401, 402, 403, 429, 451), 'gone' (404, 410), 'server' (5xx) or 'http' for other statuses.
+    """
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, ResponseTooLarge):
+        return 'too_large'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection'
+    status = error.response.status_code if getattr(error, 'response', None) is not None else None
+    if status in (401, 402, 403, 429, 451):
+        return 'blocked'
+    if status in (404, 410):
+        return 'gone'
+    if status is not None and status >= 500:
+        return 'server'
+    return 'http'
+
+def get_session():
+    """
+    Return the shared requests session, creating it on first use.
+    Connections are kept alive and reused per host, and transient errors are retried with backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                # 429 is not retried inline: it goes straight to the failure tracker's backoff
+                status_forcelist=[500, 502, 503, 504],
+                allowed_methods=['GET', 'HEAD'],
+                # A long Retry-After would hold the worker and its host slot
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            _session = session
+        return _session
+
+def read_limited(response, max_size=MAX_RESPONSE_SIZE):
+    """
+    Read the body of a streamed response, raising ResponseTooLarge past max_size bytes.
+    The body is stored on the response so .content, .text and .json() keep working.
+    """
+    length = response.headers.get('Content-Length')
+    if max_size and length and length.isdigit() and int(length) > max_size:
+        raise ResponseTooLarge(f"Response from {response.url} is {length} bytes (limit {max_size})", response=response)
+
+    chunks = []
+    total = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        total += len(chunk)
+        if max_size and total > max_size:
+            raise ResponseTooLarge(f"Response from {response.url} exceeds {max_size} bytes", response=response)
+        chunks.append(chunk)
+    response._content = b''.join(chunks)
+    return response._content
+
+def get(url, headers=None, timeout=DEFAULT_TIMEOUT, max_size=MAX_RESPONSE_SIZE, stream=False, **kwargs):
+    """
+    Perform a GET request through the shared session.
+    Unless stream=True, the body is read up front (bounded by max_size) and the connection released.
+    """
+    response = get_session().get(url, headers=headers, timeout=timeout, stream=True, **kwargs)
+    if stream:
+        return response
+    try:
+        read_limited(response, max_size)
+    finally:
+        response.close()
+    return response
+
+def post(url, json=None, timeout=DEFAULT_TIMEOUT, stream=False, **kwargs):
+    """
+    Perform a POST request through the shared session. POST requests are not retried.
+    """
+    return get_session().post(url, json=json, timeout=timeout, stream=stream, **kwargs)
@@ -0,0 +1,119 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+from urllib.parse import urlparse
+import requests
+import http_client
+from cache import Cache, RunMemo, CACHE_DIR
+
+IMAGE_STORE_DIR = os.path.join(CACHE_DIR, 'images')
+IMAGE_STORE_MAX_SIZE = 500 * 1024 * 1024  # Total bytes of image files kept on disk
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+# Stored image files keyed by SHA-256 of their content; the entry size is the size of the file and of
+# its transcoded variants, so least recently used images are evicted once the store grows past IMAGE_STORE_MAX_SIZE
+image_index = Cache('images', max_size=IMAGE_STORE_MAX_SIZE)
+_index_lock = threading.Lock()
+# Image URL -> content hash
+image_urls = Cache('image_urls')
+# Images fetched during this run, so concurrent documents share one download per URL
+image_memo = RunMemo()
+
+def guess_extension(url, content_type=None):
+    """
+    Guess an image file extension from the response content type or the URL path.
+    """
+    if content_type:
+        ext = mimetypes.guess_extension(content_type.split(';')[0].strip())
+        if ext in IMAGE_EXTENSIONS:
+            return '.jpg' if ext == '.jpeg' else ext
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return '.jpg' if ext == '.jpeg' else ext
+    return '.jpg'
+
+def get_cached_image(url):
+    """
+    Return the local path of an image already in the store, or None. Never touches the network.
+    """
+    digest = image_urls.get(url)
+    if digest is None:
+        return None
+    entry = image_index.get(digest)
+    if entry is None or not os.path.exists(entry['path']):
+        return None
+    return entry['path']
+
+def store_image(url, data, content_type=None):
+    """
+    Add downloaded image bytes to the store and return their local path.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.abspath(os.path.join(IMAGE_STORE_DIR, digest[:2], digest + guess_extension(url, content_type)))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a concurrent reader never sees a partial image
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            os.remove(temp_path)
+            raise
+
+    with _index_lock:
+        entry = image_index.get(digest)
+        # The same bytes may already be stored from another URL, with their variants
+        index_image(digest, path, entry.get('variants', {}) if entry else {}, len(data))
+    image_urls.set(url, digest)
+    return path
+
+def index_image(digest, path, variants, size):
+    """
+    Record a stored image and its variants (path -> bytes) in the index, evicting other images if needed.
+    """
+    for evicted in image_index.set(digest, {'path': path, 'variants': variants}, size=size + sum(variants.values())):
+        if evicted != digest:
+            remove_image_files(evicted)
+
+def add_variant(path, variant_path):
+    """
+    Count a file derived from a stored image (see eink.variant_path) in the store's size.
+    """
+    digest = os.path.basename(path).split('.')[0]
+    with _index_lock:
+        entry = image_index.get(digest)
+        if entry is None or variant_path in entry.get('variants', {}) or not os.path.exists(variant_path):
+            return
+        variants = dict(entry.get('variants', {}), **{variant_path: os.path.getsize(variant_path)})
+        index_image(digest, entry['path'], variants, os.path.getsize(entry['path']))
+
+def remove_image_files(digest):
+    directory = os.path.join(IMAGE_STORE_DIR, digest[:2])
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.startswith(digest):
+            os.remove(os.path.join(directory, filename))
+
+def download_image(url):
+    path = get_cached_image(url)
+    if path:
+        return path
+    try:
+        response = http_client.get(url, timeout=10)
+        response.raise_for_status()
+        return store_image(url, response.content, response.headers.get('Content-Type'))
+    except (requests.RequestException, OSError) as e:
+        print(f"Error downloading image {url}: {e}")
+        return None
+
+def fetch_image(url):
+    """
+    Return the local path of an image, downloading it into the store on first use.
+    Returns None if the image cannot be downloaded.
+    """
+    return image_memo.get_or_compute(url, download_image, url)
@@ -1,17 +1,25 @@
 import json
 import os
 from datetime import datetime
-from pdf_generator_latex import generate_pdf
+from pdf_generator_latex import generate_pdf, get_latex_stats, MAX_LATEX_JOBS
 from epub_generator import generate_epub  # Import the new EPUB generator
-from parser import process_rss_feed
+from parser import fetch_feed_articles, prepare_article, get_feed_cache_stats, get_duplicate_count, get_skipped_fetches, MAX_ARTICLE_WORKERS
+from pipeline import run_pipeline
+from dedup import Deduplicator, POLICIES as DUPLICATE_POLICIES
 from upload_remarkable import generate_folder, upload_to_tablet, send_epubs_using_epub2rm, send_pdfs_using_pdf2rm, send_epub_email
 import requests
+import http_client
 import settings
-from summarizer import summarize_article, format_summary_epub, format_summary
+from summarizer import create_summarizer, format_summary_epub, format_summary, BACKENDS
 # from email_sender import send_email_with_attachment
 import sys
 import argparse
 import subprocess
+import threading
+from cache import RunMemo
+
+# Summaries made during this run, keyed by canonical article URL and format, so shared articles are summarized once
+summary_memo = RunMemo()
 
 def ensure_correct_text(text):
     return text.replace(' ', '_')
@@ -27,7 +35,7 @@ def get_weather_data():
 
     url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={api_key}&units=metric"
     try:
-        response = requests.get(url, timeout=10)
+        response = http_client.get(url, timeout=10)
         if response.status_code == 200:
             data = response.json()
             today_data = [item for item in data['list'] if datetime.fromtimestamp(item['dt']).date() == datetime.now().date()]
@@ -52,6 +60,63 @@ def get_weather_data():
         print(f"Error fetching weather data: {e}")
     return None
 
+def summarize_and_format(article, output_format, engine):
+    """
+    Summarize an article and format the summary for the output format. Returns None on failure.
+    """
+    print(f"Summarizing article {article['title']}")
+    full_text = ' '.join([item[1] for item in article['full_content'] if item[0] == 'text'])
+    summary = engine.summarize(full_text)
+    if not summary:
+        return None
+    if output_format == 'epub':
+        return format_summary_epub(summary)
+    elif output_format == 'pdf':
+        return format_summary(summary)
+    return summary
+
+def add_summary(article, output_format, engine):
+    """
+    Insert the formatted summary at the start of the article content, summarizing each article once per run.
+    Cross-references to a story covered by another source are not summarized.
+    """
+    if article.get('duplicate_of'):
+        return article
+    if article['canonical_link']:
+        key = (article['canonical_link'], output_format)
+        formatted_summary = summary_memo.get_or_compute(key, summarize_and_format, article, output_format, engine)
+    else:
+        # Items without a link have nothing to share a summary by
+        formatted_summary = summarize_and_format(article, output_format, engine)
+    if formatted_summary:
+        article['full_content'].insert(0, ('text', formatted_summary))
+    return article
+
+def render_source(source_name, articles, args, output_folder, current_date, weather_data):
+    """
+    Generate the document for a single source. Returns the generated file path, or None.
+    """
+    if not articles:
+        print(f"No articles found for {source_name} in the last 24 hours.")
+        return None
+
+    output_filename = f"{source_name}-{current_date}"
+    output_filename = ensure_correct_text(output_filename)
+    output_path = os.path.join(output_folder, output_filename)
+
+    if args.format == 'pdf':
+        if not generate_pdf({source_name: articles}, output_path, weather_data, settings.font, dither=getattr(settings, 'EINK_DITHER', False)):
+            return None
+        generated_file = f"{output_path}.pdf"
+    elif args.format == 'epub':
+        # Images are downscaled and converted to grayscale, which keeps documents small enough to include them
+        generate_epub({source_name: articles}, output_path, weather_data, use_images=getattr(settings, 'EPUB_IMAGES', True), dither=getattr(settings, 'EINK_DITHER', False))
+        generated_file = f"{output_path}.epub"
+
+    print(f'Generated {args.format.upper()} {output_filename}')
+    print('-'*10)
+    return generated_file
+
 def main(args):
     # Create output folder if it doesn't exist
     output_folder = "output"
@@ -62,49 +127,60 @@ def main(args):
         sources = json.load(f)
 
     current_date = datetime.now().strftime('%Y%m%d')
-    generated_files = []
 
     # Get weather data
     print('Getting weather data')
     weather_data = get_weather_data()
 
-    # Generate files for each source
-    for source_name, rss_url in sources.items():
-        articles = process_rss_feed(rss_url, hours=24)
-        print(f'Obtained news from {source_name}')
-        if articles:
-            if settings.ENABLE_NEWS_SUMMARY:
-                for article in articles:
-                    print(f"Summarizing article {article['title']}")
-                    full_text = ' '.join([item[1] for item in article['full_content'] if item[0] == 'text'])
-                    summary = summarize_article(full_text, model=settings.OLLAMA_MODEL)
-                    if summary:
-                        if args.format == 'epub':
-                            formatted_summary = format_summary_epub(summary)
-                        elif args.format == 'pdf':
-                            formatted_summary = format_summary(summary)
-                        else:
-                            formatted_summary = summary
-                        article['full_content'].insert(0, ('text', formatted_summary))
-
-            output_filename = f"{source_name}-{current_date}"
-            output_filename = ensure_correct_text(output_filename)
-            output_path = os.path.join(output_folder, output_filename)
-            
-            if args.format == 'pdf':
-                generate_pdf({source_name: articles}, output_path, weather_data, settings.font)
-                generated_files.append(f"{output_path}.pdf")
-            elif args.format == 'epub':
-                generate_epub({source_name: articles}, output_path, weather_data, use_images=False)  # Some documents were too large, use_images=False always
-                # generate_epub({source_name: articles}, output_path, weather_data, use_images=False if args.upload == 'email' else True)
-                generated_files.append(f"{output_path}.epub")
-            
-            print(f'Generated {args.format.upper()} {output_filename}')
-            print('-'*10)
-        else:
-            print(f"No articles found for {source_name} in the last 24 hours.")
+    summary_engine = create_summarizer(
+        args.summarizer,
+        settings.OLLAMA_MODEL,
+        max_in_flight=getattr(settings, 'OLLAMA_MAX_IN_FLIGHT', 2),
+        timeout=getattr(settings, 'OLLAMA_TIMEOUT', 300)
+    )
+    if settings.ENABLE_NEWS_SUMMARY:
+        # Load the model while the first feeds are being fetched
+        threading.Thread(target=summary_engine.warm_up, daemon=True).start()
+
+    deduplicator = Deduplicator(args.duplicates, sources=sources)
+
+    # Fetching, extraction, summarization and rendering run as overlapping stages,
+    # with several sources in flight at a time
+    generated_files = run_pipeline(
+        sources,
+        fetch_feed=lambda url: fetch_feed_articles(url, hours=24),
+        extract_article=prepare_article,
+        summarize_article=(lambda article: add_summary(article, args.format, summary_engine)) if settings.ENABLE_NEWS_SUMMARY else None,
+        render_source=lambda source_name, articles: render_source(source_name, articles, args, output_folder, current_date, weather_data),
+        deduplicator=deduplicator if args.duplicates != 'off' else None,
+        feed_workers=args.jobs,
+        extract_workers=MAX_ARTICLE_WORKERS,
+        summary_workers=summary_engine.max_in_flight,
+        # PDF rendering waits on xelatex processes, which are capped at one per core
+        render_workers=max(args.jobs, MAX_LATEX_JOBS) if args.format == 'pdf' else args.jobs
+    )
 
     print(f'All {args.format.upper()}s generated')
+    if args.format == 'pdf':
+        latex_stats = get_latex_stats()
+        print(f"xelatex: {latex_stats['passes']} passes for {latex_stats['documents']} documents")
+
+    if settings.ENABLE_NEWS_SUMMARY:
+        summary_engine.release()
+        stats = summary_engine.stats()
+        print(f"Summaries: {stats['requests']} generated, {stats['cache_hits']} from cache, {stats['errors']} failed, {stats['fallbacks']} by the fallback, {stats['tokens_per_second']:.1f} tokens/s")
+        print(f"Summary timings: model load {stats['load_seconds']:.1f}s, prompt evaluation {stats['prompt_tokens']} tokens in {stats['prompt_seconds']:.1f}s, generation {stats['tokens']} tokens in {stats['seconds']:.1f}s")
+    print(f'{get_duplicate_count()} articles were shared between feeds instead of fetched again')
+    if deduplicator.duplicates:
+        print(f"{deduplicator.duplicates} articles were near-duplicates of another story ({args.duplicates})")
+    skipped = get_skipped_fetches()
+    if skipped:
+        details = ', '.join(f"{kind}: {count}" for kind, count in sorted(skipped.items()))
+        print(f"{sum(skipped.values())} article fetches skipped for recently failing URLs or hosts ({details})")
+
+    # Report how much the conditional-GET feed cache saved
+    for url, stats in get_feed_cache_stats().items():
+        print(f"Feed cache {url}: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes_saved'] // 1024} KB saved")
 
     ### Upload files to ReMarkable tablet or send via email
     if args.upload == 'rmapi':  # deprecated
@@ -155,6 +231,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate and upload news files to ReMarkable tablet or send via email")
     parser.add_argument("-f", "--format", choices=['pdf', 'epub'], default='pdf', help="File format to generate (pdf or epub)")
     parser.add_argument("-u", "--upload", choices=['rmapi', 'pdf2rm', 'epub2rm', 'email'], help="Upload method or email")
+    parser.add_argument("-j", "--jobs", type=int, default=getattr(settings, 'MAX_JOBS', 4), help="Number of sources processed in parallel (default: %(default)s)")
+    parser.add_argument("-d", "--duplicates", choices=DUPLICATE_POLICIES, default=getattr(settings, 'DUPLICATE_POLICY', 'xref'), help="Near-duplicate stories across feeds: drop them, keep only the longest version, replace them with a cross-reference (xref) or keep them all (off) (default: %(default)s)")
+    parser.add_argument("-s", "--summarizer", choices=BACKENDS, default=getattr(settings, 'SUMMARY_BACKEND', 'ollama'), help="Summary backend: ollama, textrank (extractive, no LLM) or auto (ollama, falling back to textrank) (default: %(default)s)")
     args = parser.parse_args()
 
     if args.upload == 'pdf2rm' and args.format != 'pdf':
@@ -1,47 +1,366 @@
 import requests
+import http_client
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta, timezone
-from email.utils import parsedate_to_datetime
+from email.utils import parsedate_to_datetime, format_datetime
+from io import BytesIO
 from scrapper import extract_article_all
+from cache import Cache, RunMemo
+from urls import canonicalize_url, remember_canonical
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from lxml import etree
+import threading
+import time
 
-def fetch_rss(url):
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+MEDIA_NS = 'http://search.yahoo.com/mrss/'
+CONTENT_NS = 'http://purl.org/rss/1.0/modules/content/'
+
+# Article fetches across all feeds share these limits, so two feeds from the same
+# publisher still cannot exceed the per-host cap together.
+MAX_ARTICLE_WORKERS = 8
+MAX_REQUESTS_PER_HOST = 2
+HOST_DELAY = 0.5  # Seconds between the start of two requests to the same host
+
+class HostLimiter:
+    """
+    Limit the number of concurrent requests per hostname and space out their start times.
+    """
+    def __init__(self, max_per_host=MAX_REQUESTS_PER_HOST, delay=HOST_DELAY):
+        self.max_per_host = max_per_host
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    def _semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    def _wait_turn(self, host):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+    def run(self, url, func, *args):
+        """
+        Call func(*args) while holding a slot for the hostname of url.
+        """
+        host = urlparse(url).hostname or ''
+        with self._semaphore(host):
+            self._wait_turn(host)
+            return func(*args)
+
+host_limiter = HostLimiter()
+
+# Failed article fetches are retried after a delay that depends on the failure class and doubles
+# with each consecutive failure
+FAILURE_TTL = 30 * 24 * 3600
+FAILURE_BACKOFF = {
+    'blocked': 6 * 3600,  # 401/403/429: paywalls and bot protection
+    'gone': 24 * 3600,  # 404/410
+    'too_large': 24 * 3600,
+    'empty': 6 * 3600,  # The page had no article text, usually a paywall or consent page
+}
+DEFAULT_FAILURE_BACKOFF = 3600  # Timeouts, connection and server errors
+MAX_FAILURE_BACKOFF = 7 * 24 * 3600
+HOST_FAILURE_THRESHOLD = 3  # Consecutive failures before a whole host is backed off
+HOST_FAILURE_CLASSES = {'timeout', 'connection', 'server', 'blocked'}
+
+class FailureTracker:
+    """
+    Persistent negative cache of article URLs and hosts that failed, so they are skipped until their
+    backoff expires instead of being retried on every run. A host is backed off once its pages fail
+    HOST_FAILURE_THRESHOLD times in a row; any success clears the URL and its host.
+    """
+    def __init__(self, host_threshold=HOST_FAILURE_THRESHOLD):
+        self.host_threshold = host_threshold
+        self.urls = Cache('failed_urls', ttl=FAILURE_TTL)
+        self.hosts = Cache('failed_hosts', ttl=FAILURE_TTL)
+        self._lock = threading.Lock()
+        self.skipped = {}  # failure class -> fetches skipped in this run
+
+    @staticmethod
+    def backoff(kind, failures):
+        return min(FAILURE_BACKOFF.get(kind, DEFAULT_FAILURE_BACKOFF) * 2 ** (failures - 1), MAX_FAILURE_BACKOFF)
+
+    def check(self, key, url):
+        """
+        Return the failure class if url (cached under key) or its host is still backed off, counting
+        the skipped fetch, or None if it may be fetched.
+        """
+        now = time.time()
+        for cache, name in ((self.hosts, urlparse(url).hostname or ''), (self.urls, key)):
+            entry = cache.get(name)
+            if entry and entry['retry_at'] > now:
+                with self._lock:
+                    self.skipped[entry['kind']] = self.skipped.get(entry['kind'], 0) + 1
+                return entry['kind']
+        return None
+
+    def record_failure(self, key, url, kind):
+        now = time.time()
+        host = urlparse(url).hostname or ''
+        with self._lock:
+            entry = self.urls.get(key)
+            failures = entry['failures'] + 1 if entry else 1
+            self.urls.set(key, {'kind': kind, 'failures': failures, 'retry_at': now + self.backoff(kind, failures)})
+            if kind in HOST_FAILURE_CLASSES:
+                entry = self.hosts.get(host)
+                failures = entry['failures'] + 1 if entry else 1
+                over = failures - self.host_threshold + 1
+                retry_at = now + self.backoff(kind, over) if over > 0 else 0
+                self.hosts.set(host, {'kind': kind, 'failures': failures, 'retry_at': retry_at})
+
+    def record_success(self, key, url):
+        self.urls.delete(key)
+        self.hosts.delete(urlparse(url).hostname or '')
+
+    def skipped_count(self):
+        with self._lock:
+            return dict(self.skipped)
+
+failure_tracker = FailureTracker()
+
+# Validators and parsed articles of the last fetch of each feed
+feed_cache = Cache('feeds', ttl=7 * 24 * 3600)
+feed_cache_stats = {}
+feed_cache_lock = threading.Lock()
+
+# Extracted full_content of each article URL
+ARTICLE_CACHE_TTL = 3 * 24 * 3600
+ARTICLE_CACHE_MAX_SIZE = 200 * 1024 * 1024
+article_cache = Cache('articles', ttl=ARTICLE_CACHE_TTL, max_size=ARTICLE_CACHE_MAX_SIZE)
+
+# Articles extracted during this run, keyed by canonical URL, so feeds sharing a story share the work
+article_memo = RunMemo()
+duplicate_articles = 0
+duplicate_lock = threading.Lock()
+
+def fetch_rss(url, etag=None, last_modified=None):
     """
     Fetch RSS content from a given URL.
+    When validators from a previous fetch are given, a conditional request is sent and the
+    returned response has status 304 if the feed has not changed. Returns None on error.
     """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
     try:
-        response = requests.get(url)
+        response = http_client.get(url, headers=headers)
         response.raise_for_status()
-        return response.content
+        return response
     except requests.RequestException as e:
         print(f"Error fetching RSS feed: {e}")
         return None
 
-def parse_rss(content, hours=24):
+def split_tag(tag):
     """
-    Parse RSS content and return a list of articles from the last specified hours.
+    Split an ElementTree tag into its namespace and local name.
     """
-    articles = []
+    if tag[:1] == '{':
+        namespace, name = tag[1:].split('}', 1)
+        return namespace, name
+    return '', tag
+
+def parse_date(date_str):
+    """
+    Parse an RFC 822 (RSS) or ISO 8601 (Atom, Dublin Core) date. Returns an aware datetime, or None.
+    """
+    if not date_str:
+        return None
+    date_str = date_str.strip()
+    try:
+        date = parsedate_to_datetime(date_str)
+    except (TypeError, ValueError):
+        try:
+            date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+def element_text(elem):
+    # Atom text constructs of type xhtml hold markup instead of text
+    if elem.get('type') == 'xhtml':
+        return ''.join(elem.itertext()).strip()
+    return (elem.text or '').strip()
+
+def add_item_field(fields, namespace, name, elem):
+    """
+    Record one child element of an RSS item or Atom entry. The first occurrence of a field wins.
+    """
+    if namespace == MEDIA_NS:
+        if name in ('content', 'thumbnail') and elem.get('url') and (
+                name == 'thumbnail' or elem.get('medium') == 'image' or elem.get('type', '').startswith('image/')):
+            fields.setdefault('image', elem.get('url'))
+        elif name in ('title', 'description'):
+            fields.setdefault(f"media_{name}", element_text(elem))
+    elif name == 'link':
+        if namespace == ATOM_NS:
+            if elem.get('rel', 'alternate') == 'alternate' and elem.get('href'):
+                fields.setdefault('link', elem.get('href'))
+        elif elem.text:
+            fields.setdefault('link', elem.text.strip())
+    elif name == 'guid' and elem.text and elem.get('isPermaLink', 'true').lower() == 'true':
+        # A permalink guid is the article URL, used when the item has no <link>
+        guid = elem.text.strip()
+        if guid.startswith(('http://', 'https://')):
+            fields.setdefault('guid_link', guid)
+    elif name in ('title', 'description', 'summary', 'pubDate', 'published', 'updated', 'date'):
+        fields.setdefault(name, element_text(elem))
+    elif name == 'content' and namespace in (ATOM_NS, CONTENT_NS):
+        fields.setdefault('content', element_text(elem))
+    elif name == 'encoded' and namespace == CONTENT_NS:
+        fields.setdefault('content', element_text(elem))
+
+def build_article(fields):
+    """
+    Turn the fields of an item or entry into an article dict, or None if it has no usable date.
+    Dates are normalized to RFC 822, as in RSS.
+    """
+    date_str = fields.get('pubDate') or fields.get('published') or fields.get('updated') or fields.get('date')
+    pub_date = parse_date(date_str)
+    if pub_date is None:
+        return None, None
+    article = {
+        'title': fields.get('title') or fields.get('media_title', ''),
+        'link': fields.get('link') or fields.get('guid_link', ''),
+        'description': fields.get('description') or fields.get('summary') or fields.get('media_description') or fields.get('content', ''),
+        'pubDate': date_str if fields.get('pubDate') else format_datetime(pub_date)
+    }
+    if fields.get('image'):
+        article['image'] = fields['image']
+    return article, pub_date
+
+def iter_feed(content, hours=24, date_sorted=False, info=None):
+    """
+    Incrementally parse RSS 2.0, Media RSS or Atom content, yielding the articles from the last
+    specified hours as soon as each item is parsed.
+    If the feed is known to be sorted newest first, parsing stops at the first older item.
+    If an info dict is given, it is filled with whether the items seen were in date order
+    ('date_sorted') and whether parsing stopped early ('stopped_early').
+    """
+    time_threshold = datetime.now(timezone.utc) - timedelta(hours=hours)
+    if info is None:
+        info = {}
+    info.update(date_sorted=True, stopped_early=False)
+    previous_date = None
+    fields = None
+    depth = 0
     try:
-        root = ET.fromstring(content)
-        current_time = datetime.now(timezone.utc)
-        time_threshold = current_time - timedelta(hours=hours)
-        
-        for item in root.findall('.//item'):
-            pub_date_str = item.find('pubDate').text if item.find('pubDate') is not None else ''
-            if pub_date_str:
-                pub_date = parsedate_to_datetime(pub_date_str)
-                if pub_date > time_threshold:
-                    article = {
-                        'title': item.find('title').text if item.find('title') is not None else '',
-                        'link': item.find('link').text if item.find('link') is not None else '',
-                        'description': item.find('description').text if item.find('description') is not None else '',
-                        'pubDate': pub_date_str
-                    }
-                    articles.append(article)
+        for event, elem in ET.iterparse(BytesIO(content), events=('start', 'end')):
+            namespace, name = split_tag(elem.tag)
+            if event == 'start':
+                if fields is None and name in ('item', 'entry'):
+                    fields = {}
+                    depth = 0
+                elif fields is not None:
+                    depth += 1
+                continue
+
+            if fields is None:
+                continue
+            if depth > 0:
+                # Only direct children of the item, and media elements at any depth (media:group)
+                if depth == 1 or namespace == MEDIA_NS:
+                    add_item_field(fields, namespace, name, elem)
+                depth -= 1
+                continue
+
+            # End of the item or entry
+            article, pub_date = build_article(fields)
+            fields = None
+            elem.clear()
+            if article is None:
+                continue
+            if previous_date is not None and pub_date > previous_date:
+                info['date_sorted'] = False
+            previous_date = pub_date
+            if pub_date > time_threshold:
+                yield article
+            elif date_sorted:
+                info['stopped_early'] = True
+                return
     except ET.ParseError as e:
         print(f"Error parsing RSS content: {e}")
-    return articles
+
+def parse_rss(content, hours=24):
+    """
+    Parse RSS or Atom content and return a list of articles from the last specified hours.
+    """
+    return list(iter_feed(content, hours))
+
+def filter_recent(articles, hours=24):
+    """
+    Keep the articles published in the last specified hours.
+    """
+    time_threshold = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return [dict(article) for article in articles if parse_date(article['pubDate']) > time_threshold]
+
+def record_feed_cache(url, hit, size=0):
+    with feed_cache_lock:
+        stats = feed_cache_stats.setdefault(url, {'hits': 0, 'misses': 0, 'bytes_saved': 0})
+        if hit:
+            stats['hits'] += 1
+            stats['bytes_saved'] += size
+        else:
+            stats['misses'] += 1
+
+def get_feed_cache_stats():
+    """
+    Return the conditional-GET hit/miss counts per feed URL for this run.
+    """
+    with feed_cache_lock:
+        return {url: dict(stats) for url, stats in feed_cache_stats.items()}
+
+def fetch_feed_articles(url, hours=24):
+    """
+    Fetch and parse a feed, yielding its recent articles as they are parsed. The articles of the
+    previous fetch are reused when the server answers a conditional request with 304 Not Modified,
+    and parsing stops early for feeds seen to be sorted newest first.
+    """
+    cached = feed_cache.get(url)
+    if cached:
+        response = fetch_rss(url, cached.get('etag'), cached.get('last_modified'))
+    else:
+        response = fetch_rss(url)
+    if response is None:
+        return
+
+    if response.status_code == 304 and cached:
+        record_feed_cache(url, hit=True, size=cached['size'])
+        yield from filter_recent(cached['articles'], hours)
+        return
+
+    record_feed_cache(url, hit=False)
+    date_sorted = bool(cached and cached.get('date_sorted'))
+    info = {}
+    articles = []
+    for article in iter_feed(response.content, hours, date_sorted=date_sorted, info=info):
+        # Keep a copy, the caller fills in the yielded article before the feed is cached
+        articles.append(dict(article))
+        yield article
+
+    feed_cache.set(url, {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'size': len(response.content),
+        'articles': articles,
+        # Any item seen out of order turns the flag off, even when parsing stopped early
+        'date_sorted': info['date_sorted']
+    })
 
 def extract_text_from_html(html_content):
     """
@@ -50,15 +369,87 @@ def extract_text_from_html(html_content):
     soup = BeautifulSoup(html_content, 'html.parser')
     return soup.get_text(separator=' ', strip=True)
 
-def process_rss_feed(url, hours=24):
+def load_article_content(key, link):
+    """
+    Return the full content of an article from the article cache, or extract it respecting the per-host limits.
+    URLs and hosts that failed recently are skipped without a request. Returns None on failure.
+    """
+    full_content = article_cache.get(key)
+    if full_content is not None:
+        return full_content
+    if failure_tracker.check(key, link):
+        return None
+    page = {}
+    try:
+        full_content = host_limiter.run(link, partial(extract_article_all, raise_errors=True, info=page), link)
+    except requests.RequestException as e:
+        print(f"Error fetching article {link}: {e}")
+        failure_tracker.record_failure(key, link, http_client.classify_error(e))
+        return None
+    except (etree.ParserError, LookupError) as e:
+        print(f"Error parsing article {link}: {e}")
+        failure_tracker.record_failure(key, link, 'parse')
+        return None
+    if not any(kind == 'text' for kind, _ in full_content):
+        failure_tracker.record_failure(key, link, 'empty')
+        return None
+
+    failure_tracker.record_success(key, link)
+    article_cache.set(key, full_content)
+    # The page may have declared a canonical URL different from the one in the feed; only trusted
+    # once the page turned out to be an article
+    remember_canonical(link, page.get('canonical'))
+    resolved = canonicalize_url(link)
+    if resolved != key:
+        article_cache.set(resolved, full_content)
+    return full_content
+
+def fetch_article_content(link):
+    """
+    Extract the full content of an article, at most once per canonical URL in a run.
+    Each caller gets its own copy of the content list, since it is modified later on.
+    """
+    global duplicate_articles
+    key = canonicalize_url(link)
+    if key in article_memo:
+        with duplicate_lock:
+            duplicate_articles += 1
+    full_content = article_memo.get_or_compute(key, load_article_content, key, link)
+    return list(full_content) if full_content is not None else None
+
+def get_skipped_fetches():
+    """
+    Return, per failure class, how many article fetches this run skipped because the URL or its host
+    failed recently.
+    """
+    return failure_tracker.skipped_count()
+
+def get_duplicate_count():
+    """
+    Return how many articles in this run were shared with another feed instead of extracted again.
+    """
+    return duplicate_articles
+
+def prepare_article(article):
+    """
+    Fill in the plain-text summary, canonical link and full content of an article parsed from a feed.
+    If the page cannot be extracted, or the item has no link, the feed's description is used as the content.
+    """
+    article['summary'] = extract_text_from_html(article['description'])
+    article['canonical_link'] = canonicalize_url(article['link'])
+    full_content = fetch_article_content(article['link']) if article['link'] else None
+    if full_content is None:
+        full_content = [('text', article['summary'])] if article['summary'] else []
+    article['full_content'] = full_content
+    return article
+
+def process_rss_feed(url, hours=24, max_workers=MAX_ARTICLE_WORKERS):
     """
     Process an RSS feed: fetch, parse, and extract full content for articles from the last specified hours.
+    Articles are extracted in parallel and returned in feed order.
     """
-    content = fetch_rss(url)
-    if content:
-        articles = parse_rss(content, hours)
-        for article in articles:
-            article['summary'] = extract_text_from_html(article['description'])
-            article['full_content'] = extract_article_all(article['link'])
-        return articles
+    articles = list(fetch_feed_articles(url, hours))
+    if articles:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            return list(executor.map(prepare_article, articles))
     return []
\ No newline at end of file
@@ -1,76 +1,87 @@
 import os
 import shutil
-import requests
+import subprocess
+import tempfile
+import threading
+import time
+import hashlib
+import io
+import http_client
+from cache import Cache, CACHE_DIR
+from image_store import fetch_image
+from eink import prepare_images, COLUMN_SIZE
 from datetime import datetime
 from parser import process_rss_feed
-from urllib.parse import urlparse
-from pathlib import Path
+from dedup import duplicate_note
 import re
 
+XELATEX = 'xelatex'
+XELATEX_TIMEOUT = 300  # Seconds allowed for one pass
+MAX_LATEX_JOBS = os.cpu_count() or 1  # xelatex processes running at the same time, across all documents
+
+# Shared by every document being rendered, so concurrent sources never run more TeX processes than cores
+latex_slots = threading.BoundedSemaphore(MAX_LATEX_JOBS)
+
+# Precompiled preambles (mylatexformat), one per font and preamble version, reused across runs
+LATEX_FORMAT_DIR = os.path.join(CACHE_DIR, 'latex-formats')
+USE_LATEX_FORMAT = True
+_format_locks = {}
+_format_locks_lock = threading.Lock()
+_broken_formats = set()  # Formats that failed to load in this run
+# Formats that could not be built (some fonts cannot be dumped), by name, so later runs do not retry every time
+format_failures = Cache('latex_format_failures', ttl=7 * 24 * 3600)
+# What xelatex prints when it cannot use a format file, as opposed to errors in the document itself
+FORMAT_LOAD_ERROR_RE = re.compile(r"Fatal format file error|I can't find the format file|---! .*\.fmt ")
+
+# xelatex is rerun until the files it reads back are stable, which usually takes two passes for a new
+# table of contents, and one when the seed from the previous edition is still right
+MAX_LATEX_PASSES = 3
+AUX_EXTENSIONS = ['.aux', '.toc', '.out']
+aux_cache = Cache('latex_aux', ttl=30 * 24 * 3600)
+latex_stats = {'documents': 0, 'passes': 0}
+latex_stats_lock = threading.Lock()
+
+# One translation table does the escaping, the removal of control and Latin-1 characters and the
+# typographic replacements in a single pass over the text
+LATEX_ESCAPES = str.maketrans({
+    '&': r'\&',
+    '%': r'\%',
+    '$': r'\$',
+    '#': r'\#',
+    '_': r'\_',
+    '{': r'\{',
+    '}': r'\}',
+    '~': r'\textasciitilde{}',
+    '^': r'\^{}',
+    '\\': r'\textbackslash{}',
+    **{chr(c): None for c in [*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), *range(0x7F, 0x100)]},
+    '\u2018': "'",
+    '\u2019': "'",
+    '"': "``",
+    '\u201c': "``",
+    '\u201d': "''",
+    '–': '--',
+    '—': '---',
+    '…': '...',
+})
+
 def escape_latex(text):
     """
     Escape special LaTeX characters and remove problematic Unicode characters.
     """
-    special_chars = {
-        '&': r'\&',
-        '%': r'\%',
-        '$': r'\$',
-        '#': r'\#',
-        '_': r'\_',
-        '{': r'\{',
-        '}': r'\}',
-        '~': r'\textasciitilde{}',
-        '^': r'\^{}',
-        '\\': r'\textbackslash{}',
-    }
-    
-    # First, escape the special LaTeX characters
-    escaped_text = ''.join(special_chars.get(c, c) for c in text)
-    
-    # Remove or replace problematic Unicode characters
-    escaped_text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\xFF]', '', escaped_text)
-    
-    # Replace other common Unicode characters
-    escaped_text = escaped_text.replace(''', "'").replace(''', "'").replace('"', "``").replace('"', "''")
-    escaped_text = escaped_text.replace('–', '--').replace('—', '---').replace('…', '...')
-    
-    return escaped_text
+    return text.translate(LATEX_ESCAPES)
 
-def download_image(url, output_dir):
+def download_image(url):
     """
-    Download an image from a URL and save it to the output directory.
-    Returns the local path to the saved image.
+    Get an image from the shared image store, downloading it on first use.
+    Returns the local path to the image.
     """
-    try:
-        response = requests.get(url, stream=True, timeout=10)
-        response.raise_for_status()
-        
-        # Extract filename from URL
-        filename = os.path.basename(urlparse(url).path)
-        if not filename:
-            filename = 'image.jpg'  # Default filename if none is found in URL
-        
-        # Ensure unique filename
-        local_path = Path(output_dir) / filename
-        counter = 1
-        while local_path.exists():
-            name, ext = os.path.splitext(filename)
-            local_path = Path(output_dir) / f"{name}_{counter}{ext}"
-            counter += 1
-        
-        with open(local_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        
-        return str(local_path)
-    except Exception as e:
-        print(f"Error downloading image {url}: {e}")
-        return None
+    return fetch_image(url)
     
 
 def get_weather_data(api_key, lat, lon):
     url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code == 200:
         data = response.json()
         return {
@@ -81,9 +92,17 @@ def get_weather_data(api_key, lat, lon):
     else:
         return None
 
-def create_latex_document(articles_by_source, image_dir, weather_data, font_option="default"):
+def get_image_urls(articles_by_source):
     """
-    Create the LaTeX document content.
+    List the URLs of all images in the articles, in document order.
+    """
+    return [item['url'] for articles in articles_by_source.values() for article in articles
+            for item_type, item in article['full_content'] if item_type == 'image']
+
+def latex_preamble(font_option="default"):
+    """
+    Return the lines of the static part of the preamble, which only depends on the font.
+    It is precompiled into a format file when possible (see get_latex_format).
     """
     font_packages = {
         "default": [
@@ -110,13 +129,12 @@ def create_latex_document(articles_by_source, image_dir, weather_data, font_opti
 
     chosen_font = font_packages.get(font_option, font_packages["default"])
 
-    latex_content = [
+    return [
         r"\documentclass[12pt,a4paper,twocolumn]{article}",
         r"\usepackage[utf8]{inputenc}",
         r"\usepackage[T1]{fontenc}",
             ] + chosen_font + [
         r"\usepackage{graphicx}",        
-        r"\usepackage{hyperref}",
         r"\usepackage{url}",
         r"\usepackage[margin=1in]{geometry}",
         r"\usepackage{fancyhdr}",
@@ -132,6 +150,16 @@ def create_latex_document(articles_by_source, image_dir, weather_data, font_opti
         r"\setlength{\columnsep}{1cm}",
         r"\setlength{\emergencystretch}{3em}",
         r"\tolerance=1000",
+    ]
+
+def latex_header(weather_data, font_option="default"):
+    """
+    Return the lines of the document up to the table of contents: preamble, title and weather widget.
+    """
+    header = latex_preamble(font_option) + [
+        # End of the precompiled part when a format is used; expands to \relax otherwise
+        r"\csname endofdump\endcsname",
+        r"\usepackage{hyperref}",  # hyperref does not survive being dumped into a format
         r"\title{\Huge\textbf{ReMarkNews}}",  # Increased title size
         fr"\date{{{datetime.now().strftime('%Y-%m-%d')}}}",
         r"\begin{document}",
@@ -148,15 +176,15 @@ def create_latex_document(articles_by_source, image_dir, weather_data, font_opti
     ]
 
     if weather_data:
-        latex_content.extend([
+        header.extend([
             fr"Min/Max Temp: {weather_data['temp_min']}/{weather_data['temp_max']}°C\\",
             fr"Rain Prob: {weather_data['rain_prob']}\%\\",
             fr"Forecast: {weather_data['description']}"
         ])
     else:
-        latex_content.append(r"Weather data unavailable")
+        header.append(r"Weather data unavailable")
     
-    latex_content.extend([
+    header.extend([
         r"\end{center}",
         r"\end{minipage}",
         r"};",
@@ -165,84 +193,248 @@ def create_latex_document(articles_by_source, image_dir, weather_data, font_opti
         r"\tableofcontents",
         r"\newpage"
     ])
+    return header
 
+def latex_article(article, image_paths=None):
+    """
+    Return the LaTeX fragment for one article, ending with a page break.
+    """
+    lines = [
+        fr"\subsection{{{escape_latex(article['title'])}}}",
+        fr"\textit{{Published: {escape_latex(article['pubDate'])}}}",
+        r"",
+    ]
+    duplicate_of = article.get('duplicate_of')
+    if duplicate_of:
+        lines += [fr"\textit{{{escape_latex(duplicate_note(duplicate_of))}}}", r""]
 
+    for item_type, item in article['full_content']:
+        if item_type == 'text':
+            lines.append(item)  # The summary is already formatted in LaTeX
+            lines.append(r"")
+        elif item_type == 'image':
+            local_image_path = image_paths[item['url']] if image_paths and item['url'] in image_paths else download_image(item['url'])
+            if local_image_path:
+                lines.extend([
+                    r"\begin{figure}[htbp]",
+                    r"\centering",
+                    fr"\includegraphics[width=0.8\columnwidth]{{{local_image_path}}}",
+                    fr"\caption{{{escape_latex(item.get('caption', '') or item.get('alt', ''))}}}",
+                    r"\end{figure}",
+                    r""
+                ])
+
+    lines.append(r"\newpage")
+    return '\n'.join(lines) + '\n'
+
+def write_latex_document(out, articles_by_source, weather_data, font_option="default", image_paths=None):
+    """
+    Write the LaTeX document to the text file out, one article at a time, so the whole document
+    is never held in memory.
+    image_paths maps image URLs to local files already prepared; other images are downloaded as is.
+    """
+    out.write('\n'.join(latex_header(weather_data, font_option)) + '\n')
     for source, articles in articles_by_source.items():
-        latex_content.extend([
-            fr"\section{{{escape_latex(source)}}}"
-        ])
+        out.write(fr"\section{{{escape_latex(source)}}}" + '\n')
+        for article in articles:
+            out.write(latex_article(article, image_paths))
+    out.write(r"\end{document}")
 
-        for source, articles in articles_by_source.items():
-            latex_content.extend([
-                fr"\section{{{escape_latex(source)}}}"
-            ])
+def create_latex_document(articles_by_source, weather_data, font_option="default", image_paths=None):
+    """
+    Create the LaTeX document content as a string.
+    """
+    buffer = io.StringIO()
+    write_latex_document(buffer, articles_by_source, weather_data, font_option, image_paths)
+    return buffer.getvalue()
 
-            for article in articles:
-                latex_content.extend([
-                    fr"\subsection{{{escape_latex(article['title'])}}}",
-                    fr"\textit{{Published: {escape_latex(article['pubDate'])}}}",
-                    r"",
-                ])
+def run_xelatex(tex_filename, workdir, fmt=None, extra_args=()):
+    """
+    Run one xelatex pass over a .tex file in workdir, waiting for a free slot first.
+    fmt is the name of a format file in workdir to load instead of the default one.
+    Returns the exit status (None if xelatex could not be run) and the compile log.
+    """
+    command = [XELATEX, '-interaction=nonstopmode', '-file-line-error']
+    if fmt:
+        command.append(f'-fmt={fmt}')
+    command += list(extra_args) + [os.path.basename(tex_filename)]
+    with latex_slots:
+        try:
+            result = subprocess.run(
+                command, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=XELATEX_TIMEOUT
+            )
+        except FileNotFoundError:
+            return None, f"{XELATEX} not found"
+        except subprocess.TimeoutExpired as e:
+            return None, f"{XELATEX} timed out after {XELATEX_TIMEOUT}s\n{(e.output or b'').decode('utf-8', 'replace')}"
 
-                for item_type, item in article['full_content']:
-                    if item_type == 'text':
-                        latex_content.append(item)  # The summary is already formatted in LaTeX
-                        latex_content.append(r"")
-                    elif item_type == 'image':
-                        local_image_path = download_image(item['url'], image_dir)
-                        if local_image_path:
-                            latex_content.extend([
-                                r"\begin{figure}[htbp]",
-                                r"\centering",
-                                fr"\includegraphics[width=0.8\columnwidth]{{{local_image_path}}}",
-                                fr"\caption{{{escape_latex(item.get('caption', '') or item.get('alt', ''))}}}",
-                                r"\end{figure}",
-                                r""
-                            ])
+    log_filename = os.path.splitext(tex_filename)[0] + '.log'
+    if os.path.exists(log_filename):
+        with open(log_filename, 'r', encoding='utf-8', errors='replace') as log_file:
+            return result.returncode, log_file.read()
+    return result.returncode, result.stdout.decode('utf-8', 'replace')
 
-                latex_content.append(r"\newpage")
+def get_latex_format(font_option="default"):
+    """
+    Return the path of the precompiled format for the preamble of the given font, building it on first use.
+    The file name includes a hash of the preamble, so editing the preamble builds a new format.
+    Returns None if the format cannot be built (for example without the mylatexformat package).
+    """
+    preamble = '\n'.join(latex_preamble(font_option))
+    digest = hashlib.sha256(preamble.encode('utf-8')).hexdigest()[:16]
+    name = f"remarknews-{re.sub(r'[^a-z0-9]', '', font_option.lower()) or 'default'}-{digest}"
+    fmt_path = os.path.abspath(os.path.join(LATEX_FORMAT_DIR, f"{name}.fmt"))
+    if name in _broken_formats or format_failures.get(name):
+        return None
+    if os.path.exists(fmt_path):
+        return fmt_path
 
-    latex_content.append(r"\end{document}")
+    with _format_locks_lock:
+        lock = _format_locks.setdefault(name, threading.Lock())
+    with lock:
+        # Another document may have built it, or failed to, while this one waited
+        if name in _broken_formats or format_failures.get(name):
+            return None
+        if os.path.exists(fmt_path):
+            return fmt_path
+        with tempfile.TemporaryDirectory(prefix='remarknews-fmt-') as workdir:
+            tex_filename = os.path.join(workdir, f"{name}.tex")
+            with open(tex_filename, 'w', encoding='utf-8') as tex_file:
+                tex_file.write(preamble + '\n\\begin{document}\n\\end{document}\n')
+            # Dump everything up to \begin{document} on top of the standard xelatex format
+            status, log = run_xelatex(tex_filename, workdir, extra_args=['-ini', f'-jobname={name}', '&xelatex', 'mylatexformat.ltx'])
+            built = os.path.join(workdir, f"{name}.fmt")
+            if status != 0 or not os.path.exists(built):
+                print(f"Could not build the LaTeX format for font {font_option}, compiling without it")
+                format_failures.set(name, True)
+                return None
+            os.makedirs(LATEX_FORMAT_DIR, exist_ok=True)
+            shutil.move(built, f"{fmt_path}.{os.getpid()}.tmp")
+            os.replace(f"{fmt_path}.{os.getpid()}.tmp", fmt_path)
+    return fmt_path
 
-    return '\n'.join(latex_content)
+def format_load_failed(log):
+    """
+    Whether a compile log shows that xelatex could not load the precompiled format.
+    """
+    return bool(FORMAT_LOAD_ERROR_RE.search(log or ''))
 
-def generate_pdf(articles_by_source, output_path, weather_data, font='default'):
+def discard_latex_format(fmt_path):
     """
-    Generate the PDF using LaTeX.
+    Stop using a format that failed to load (for example after a TeX upgrade); it is rebuilt next run.
     """
-    # Create images directory
-    image_dir = os.path.join(os.path.dirname(output_path), "images")
-    os.makedirs(image_dir, exist_ok=True)
-    
+    _broken_formats.add(os.path.splitext(os.path.basename(fmt_path))[0])
+    try:
+        os.remove(fmt_path)
+    except OSError:
+        pass
+
+def read_aux_files(workdir, name):
+    """
+    Return the contents of the files xelatex reads back on the next pass (.aux, .toc, .out), by extension.
+    """
+    files = {}
+    for ext in AUX_EXTENSIONS:
+        path = os.path.join(workdir, f"{name}{ext}")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                files[ext] = f.read()
+    return files
+
+def compile_latex(write_document, output_path, max_passes=MAX_LATEX_PASSES, fmt_path=None, seed=None):
+    """
+    Compile a LaTeX document, written by write_document(file), to output_path.pdf in its own temporary directory, so documents
+    rendered concurrently never share auxiliary files. fmt_path is an optional precompiled format.
+    Passes are repeated only while the .aux/.toc/.out files they write differ from the ones they read.
+    seed holds auxiliary files from an earlier compile of a similar document; when they are still
+    right, a single pass is enough.
+    Returns a dict with the exit status of the last pass, the number of passes run, the compile log
+    and the final auxiliary files. On failure the log is kept as output_path.log.
+    """
+    name = os.path.basename(output_path)
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix='remarknews-tex-') as workdir:
+        tex_filename = os.path.join(workdir, f"{name}.tex")
+        with open(tex_filename, 'w', encoding='utf-8') as tex_file:
+            write_document(tex_file)
+        fmt = None
+        if fmt_path:
+            # xelatex looks formats up by name, and the working directory is searched first
+            fmt = os.path.splitext(os.path.basename(fmt_path))[0]
+            os.symlink(fmt_path, os.path.join(workdir, f"{fmt}.fmt"))
+        for ext, data in (seed or {}).items():
+            with open(os.path.join(workdir, f"{name}{ext}"), 'wb') as f:
+                f.write(data)
+
+        pdf_filename = os.path.join(workdir, f"{name}.pdf")
+        status, log = None, ''
+        runs = 0
+        aux_files = read_aux_files(workdir, name)
+        for _ in range(max_passes):
+            status, log = run_xelatex(tex_filename, workdir, fmt)
+            runs += 1
+            # Without a PDF the error was fatal, and another pass would fail the same way
+            if status is None or not os.path.exists(pdf_filename):
+                break
+            previous, aux_files = aux_files, read_aux_files(workdir, name)
+            if aux_files == previous:
+                # Cross-references and the table of contents are stable
+                break
+
+        # In nonstopmode xelatex often produces a usable PDF despite errors, so keep it either way
+        ok = os.path.exists(pdf_filename)
+        if ok:
+            shutil.move(pdf_filename, f"{output_path}.pdf")
+
+    result = {'status': status, 'passes': runs, 'log': log, 'seconds': time.monotonic() - started, 'ok': ok, 'aux_files': aux_files}
+    with latex_stats_lock:
+        latex_stats['documents'] += 1
+        latex_stats['passes'] += runs
+    if not ok or status != 0:
+        with open(f"{output_path}.log", 'w', encoding='utf-8') as log_file:
+            log_file.write(log)
+    return result
+
+def generate_pdf(articles_by_source, output_path, weather_data, font='default', dither=False):
+    """
+    Generate the PDF using LaTeX. Returns True if the PDF was created.
+    Images are converted to grayscale and downscaled to the column width before embedding.
+    """
+    image_paths = prepare_images(get_image_urls(articles_by_source), max_size=COLUMN_SIZE, dither=dither)
+
     # Available fonts: libertinus, source, roboto, noto
-    latex_content = create_latex_document(articles_by_source, image_dir, weather_data, font_option=font)
-    
-    # Write LaTeX content to a .tex file
-    tex_filename = f"{output_path}.tex"
-    with open(tex_filename, 'w', encoding='utf-8') as tex_file:
-        tex_file.write(latex_content)
-    
-    # Compile LaTeX to PDF
-    os.system(f"xelatex -interaction=nonstopmode -output-directory={os.path.dirname(output_path)} {tex_filename}")
-    
-    # Run twice to generate the table of contents
-    os.system(f"xelatex -interaction=nonstopmode -output-directory={os.path.dirname(output_path)} {tex_filename}")
-    
-    # Clean up auxiliary files
-    for ext in ['.aux', '.log', '.out', '.toc']:
-        aux_file = f"{output_path}{ext}"
-        if os.path.exists(aux_file):
-            os.remove(aux_file)
-    
-    # Remove the images directory
-    shutil.rmtree(image_dir, ignore_errors=True)
+    def write_document(tex_file):
+        write_latex_document(tex_file, articles_by_source, weather_data, font_option=font, image_paths=image_paths)
 
-    # Remove the .tex file
-    if os.path.exists(tex_filename):
-        os.remove(tex_filename)
-    
-    print(f"PDF created successfully: {output_path}.pdf")
-    print("Temporary files and images have been cleaned up.")
+    fmt_path = get_latex_format(font) if USE_LATEX_FORMAT else None
+
+    # The table of contents of the previous edition of the same sources is a good first guess:
+    # if the page layout did not change, the first pass already writes it back unchanged
+    seed_key = f"{font}:{'|'.join(articles_by_source)}"
+    seed = aux_cache.get(seed_key)
+    result = compile_latex(write_document, output_path, fmt_path=fmt_path, seed=seed)
+    # Other documents may be using the same format, so it is only dropped when it is the problem
+    if fmt_path and not result['ok'] and format_load_failed(result['log']):
+        discard_latex_format(fmt_path)
+        result = compile_latex(write_document, output_path, seed=seed)
+    if result['ok'] and result['aux_files']:
+        aux_cache.set(seed_key, result['aux_files'])
+
+    if not result['ok']:
+        print(f"Error creating PDF {output_path}.pdf (xelatex exit status {result['status']}), see {output_path}.log")
+        return False
+    if result['status'] != 0:
+        print(f"PDF created with LaTeX errors: {output_path}.pdf, see {output_path}.log")
+    else:
+        print(f"PDF created successfully: {output_path}.pdf (xelatex passes: {result['passes']}, {result['seconds']:.1f}s)")
+    return True
+
+def get_latex_stats():
+    """
+    Return the number of documents compiled in this run and the xelatex passes they took.
+    """
+    with latex_stats_lock:
+        return dict(latex_stats)
 
 if __name__ == "__main__":
     rss_sources = {
@@ -258,6 +450,6 @@ if __name__ == "__main__":
     
     if articles_by_source:
         output_filename = f"daily_news_{datetime.now().strftime('%Y%m%d')}"
-        generate_pdf(articles_by_source, output_filename)
+        generate_pdf(articles_by_source, output_filename, None)
     else:
         print("No articles found in the last 24 hours.")
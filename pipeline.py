@@ -0,0 +1,160 @@
+import queue
+import threading
+
+QUEUE_SIZE = 16  # Items waiting between two stages; a full queue blocks the stage feeding it
+
+_DONE = object()
+
+class Stage:
+    """
+    A pool of worker threads reading items from a bounded queue.
+    func(item) returns the items to pass to the next stage. Stage functions are expected to handle
+    their own errors; an item whose function raises is reported and dropped.
+    """
+    def __init__(self, name, func, workers=1, next_stage=None, on_close=None, maxsize=QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.next_stage = next_stage
+        self.on_close = on_close
+        self.queue = queue.Queue(maxsize)
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def emit(self, items):
+        if self.next_stage is not None:
+            for item in items:
+                self.next_stage.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                break
+            try:
+                # func may be a generator, so its items are passed on as they are produced
+                self.emit(self.func(item) or ())
+            except Exception as e:
+                print(f"Error in {self.name} stage: {e}")
+
+    def close(self):
+        """
+        Wait for the queued items to be processed, then close the following stages in turn.
+        """
+        for _ in self._threads:
+            self.queue.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+        if self.on_close is not None:
+            self.emit(self.on_close() or ())
+        if self.next_stage is not None:
+            self.next_stage.close()
+
+def run_pipeline(sources, fetch_feed, extract_article, render_source, summarize_article=None, deduplicator=None,
+                 feed_workers=4, extract_workers=8, summary_workers=2, render_workers=4):
+    """
+    Run the news pipeline with the stages overlapped: feeds are fetched, articles extracted,
+    deduplicated, summarized and sources rendered concurrently, connected by bounded queues.
+
+    :param sources: Dict of source name to feed URL
+    :param fetch_feed: fetch_feed(url) returns or yields the articles in the feed
+    :param extract_article: extract_article(article) fills in the article's full content
+    :param render_source: render_source(source_name, articles) returns the generated file path, or None
+    :param summarize_article: summarize_article(article) adds the summary to the article; None skips the stage
+    :param deduplicator: dedup.Deduplicator clustering the extracted articles of all sources before they
+        are summarized; None skips the stage
+    :return: Generated file paths, in the order of the sources
+    """
+    results = {}
+    results_lock = threading.Lock()
+    expected = {}  # source name -> number of articles, once the feed is fetched
+    collected = {}  # source name -> {index: article}
+
+    def render(job):
+        source_name, articles = job
+        path = render_source(source_name, articles)
+        with results_lock:
+            results[source_name] = path
+
+    def ready(source_name):
+        articles = collected.pop(source_name)
+        expected.pop(source_name, None)
+        # Dropped duplicates arrive as None so the collector can still count them
+        return (source_name, [articles[index] for index in sorted(articles) if articles[index] is not None])
+
+    def collect(item):
+        # A single worker, so the bookkeeping below needs no lock
+        kind, source_name = item[0], item[1]
+        if kind == 'feed':
+            expected[source_name] = item[2]
+            collected.setdefault(source_name, {})
+        else:
+            collected.setdefault(source_name, {})[item[2]] = item[3]
+        if source_name in expected and len(collected[source_name]) == expected[source_name]:
+            return [ready(source_name)]
+        return []
+
+    def flush():
+        # Render whatever arrived for sources that lost articles to a failing stage, including
+        # sources whose article count never came
+        return [ready(source_name) for source_name in list(collected)]
+
+    def extract(item):
+        _, source_name, index, article = item
+        return [('article', source_name, index, extract_article(article))]
+
+    def summarize(item):
+        _, source_name, index, article = item
+        if article is None:
+            return [item]
+        return [('article', source_name, index, summarize_article(article))]
+
+    def dedupe(item):
+        _, source_name, index, article = item
+        return [('article', key[0], key[1], article) for key, article in deduplicator.add((source_name, index), source_name, article)]
+
+    def release_held():
+        return [('article', key[0], key[1], article) for key, article in deduplicator.flush()]
+
+    render_stage = Stage('render', render, workers=render_workers)
+    collect_stage = Stage('collect', collect, workers=1, next_stage=render_stage, on_close=flush)
+    middle_stages = []
+    next_stage = collect_stage
+    if summarize_article is not None:
+        next_stage = Stage('summarize', summarize, workers=summary_workers, next_stage=next_stage)
+        middle_stages.append(next_stage)
+    if deduplicator is not None:
+        next_stage = Stage('dedupe', dedupe, workers=1, next_stage=next_stage, on_close=release_held)
+        middle_stages.append(next_stage)
+    extract_stage = Stage('extract', extract, workers=extract_workers, next_stage=next_stage)
+
+    def fetch(source):
+        source_name, url = source
+        count = 0
+        try:
+            for index, article in enumerate(fetch_feed(url)):
+                count += 1
+                yield ('article', source_name, index, article)
+        finally:
+            # Tell the collector how many articles to wait for, even if the feed failed halfway;
+            # some may already have reached it
+            collect_stage.put(('feed', source_name, count))
+
+    fetch_stage = Stage('fetch', fetch, workers=feed_workers, next_stage=extract_stage)
+    for stage in [render_stage, collect_stage, *middle_stages, extract_stage, fetch_stage]:
+        stage.start()
+
+    for source in sources.items():
+        fetch_stage.put(source)
+    fetch_stage.close()
+
+    return [results[source_name] for source_name in sources if results.get(source_name)]
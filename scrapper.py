@@ -1,9 +1,35 @@
 import requests
+import http_client
 from bs4 import BeautifulSoup
 import re
 from urllib.parse import urlparse, urljoin
 from PIL import Image
 from io import BytesIO
+import struct
+from cache import Cache
+import image_store
+import codecs
+import json
+import os
+import threading
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from cssselect import SelectorError
+
+IMAGE_PROBE_SIZE = 16 * 1024  # Bytes requested to read an image header
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+EXTRACTION_ENGINE = 'lxml'  # 'lxml', or 'bs4' for the original BeautifulSoup extractor
+EXTRACTION_RULES_FILE = 'extraction_rules.json'  # Per-site content and exclude selectors
+CANONICAL_XPATH = etree.XPath("//link[contains(concat(' ', translate(normalize-space(@rel), 'CANONIL', 'canonil'), ' '), ' canonical ')]/@href")
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+CONTENT_CLASS_RE = re.compile('(content|article)')
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+HEADER_CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+# (width, height) of images already probed, keyed by URL
+image_size_cache = Cache('image_sizes', ttl=30 * 24 * 3600)
 
 def extract_article_text(url):
     """
@@ -11,7 +37,7 @@ def extract_article_text(url):
     """
     try:
         # Fetch the webpage
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+        response = http_client.get(url)
         response.raise_for_status()
         
         # Parse the HTML content
@@ -54,14 +80,90 @@ def is_valid_image_url(url):
     parsed = urlparse(url)
     return bool(parsed.netloc) and bool(parsed.scheme) and any(parsed.path.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp'])
 
+def parse_image_header(data):
+    """
+    Parse the width and height of a JPEG, PNG, GIF or WebP image from its first bytes.
+    Returns None if the format is unknown or the dimensions are not in the data yet.
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return (width, height)
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', data[6:10])
+        return (width, height)
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return (width & 0x3FFF, height & 0x3FFF)
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', data[21:25])[0]
+            return ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        if chunk == b'VP8X':
+            return (int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1)
+        return None
+    if data[:2] == b'\xff\xd8':
+        # Walk the JPEG segments until a start-of-frame marker
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return (width, height)
+            if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                i += 1 if marker == 0xFF else 2
+                continue
+            i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
 def get_image_size(url):
     """
     Get the size of an image from its URL.
+    Only the first bytes are requested (HTTP Range) and parsed; the whole image is downloaded
+    only when the dimensions are not found there, and then kept in the image store. Sizes are cached by URL.
     """
+    size = image_size_cache.get(url)
+    if size is not None:
+        return size
     try:
-        response = requests.get(url, stream=True, timeout=5)
-        img = Image.open(BytesIO(response.content))
-        return img.size
+        local_path = image_store.get_cached_image(url)
+        if local_path:
+            with Image.open(local_path) as img:
+                size = img.size
+            image_size_cache.set(url, size)
+            return size
+
+        response = http_client.get(url, headers={'Range': f'bytes=0-{IMAGE_PROBE_SIZE - 1}'}, timeout=5, stream=True)
+        try:
+            response.raise_for_status()
+            data = b''
+            chunks = response.iter_content(chunk_size=4096)
+            for chunk in chunks:
+                data += chunk
+                size = parse_image_header(data)
+                if size or len(data) >= IMAGE_PROBE_SIZE:
+                    break
+            if size is None and response.status_code == 200:
+                # The server ignored the Range header, so the rest of the image is on this response,
+                # read within the same size limit as any other download
+                data += http_client.read_limited(response, http_client.MAX_RESPONSE_SIZE - len(data))
+        finally:
+            response.close()
+
+        if size is None:
+            if response.status_code == 206:
+                response = http_client.get(url, timeout=5)
+                response.raise_for_status()
+                data = response.content
+            size = Image.open(BytesIO(data)).size
+            # The renderers will need the full image anyway
+            image_store.store_image(url, data, response.headers.get('Content-Type'))
+
+        image_size_cache.set(url, size)
+        return size
     except Exception as e:
         print(f"Error getting image size: {e}")
         return (0, 0)
@@ -144,70 +246,266 @@ def is_high_quality_image(url, min_width=300, min_height=200):
 #         return None
 
 
-def extract_article_all(url):
+def extract_content_bs4(html, url, keep_image=is_high_quality_image, info=None):
+    """
+    Extract the text and images of an article page with BeautifulSoup.
+    This is the original engine, kept for comparison with the lxml one.
+    If an info dict is given, the page's declared canonical URL is stored in it ('canonical').
+    """
+    # Parse the HTML content
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # The caller remembers the canonical URL once it knows the extraction worked
+    canonical = soup.find('link', rel='canonical')
+    if info is not None and canonical and canonical.get('href'):
+        info['canonical'] = canonical['href']
+    
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+    
+    # Find the main content
+    main_content = soup.find('article') or soup.find('main') or soup.find('div', class_=re.compile('(content|article)'))
+    
+    if not main_content:
+        main_content = soup  # Fallback to entire body if no main content is identified
+    
+    # Extract text and images, maintaining order and paragraph structure
+    content = []
+    current_paragraph = []
+    
+    for element in main_content.descendants:
+        if element.name == 'p':
+            if current_paragraph:
+                content.append(('text', '\n\n'.join(current_paragraph)))
+                current_paragraph = []
+            text = element.get_text().strip()
+            if text:
+                current_paragraph.append(text)
+        elif element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+            if current_paragraph:
+                content.append(('text', '\n\n'.join(current_paragraph)))
+                current_paragraph = []
+            text = element.get_text().strip()
+            if text:
+                content.append(('text', f"\n\n{text}\n"))
+        elif element.name == 'img':
+            if current_paragraph:
+                content.append(('text', '\n\n'.join(current_paragraph)))
+                current_paragraph = []
+            src = extract_image_url(element, url)
+            alt = element.get('alt', '')
+            caption = element.find_next('figcaption')
+            caption_text = caption.get_text().strip() if caption else ''
+            
+            if src and keep_image(src) and (alt or caption_text):
+                content.append(('image', {'url': src, 'alt': alt, 'caption': caption_text}))
+    
+    # Add any remaining paragraph text
+    if current_paragraph:
+        content.append(('text', '\n\n'.join(current_paragraph)))
+    
+    return content
+
+def parse_html_bytes(data, encoding=None):
+    """
+    Parse raw page bytes with lxml. The charset comes from the HTTP header when given, otherwise from
+    the page's own <meta> declaration, and defaults to UTF-8. A header charset Python does not know is ignored.
+    """
+    if encoding:
+        try:
+            encoding = codecs.lookup(encoding).name
+        except LookupError:
+            encoding = None
+    if not encoding and not META_CHARSET_RE.search(data[:2048]):
+        encoding = 'utf-8'
+    parser = lxml.html.HTMLParser(encoding=encoding, remove_comments=True)
+    return lxml.html.document_fromstring(data, parser=parser)
+
+class SiteRules:
+    """
+    Extraction rules for one site: CSS selectors for the article body, tried in order, and for
+    subtrees to remove from it (related links, newsletter boxes...). Selectors are compiled once.
+    """
+    def __init__(self, host, content=(), exclude=()):
+        self.host = host
+        self.content = [CSSSelector(selector) for selector in content]
+        self.exclude = [CSSSelector(selector) for selector in exclude]
+
+    def find_content(self, root):
+        for selector in self.content:
+            matches = selector(root)
+            if matches:
+                return matches[0]
+        return None
+
+    def prune(self, element):
+        for selector in self.exclude:
+            for match in selector(element):
+                if match is not element:
+                    match.drop_tree()
+
+def load_extraction_rules(path=EXTRACTION_RULES_FILE):
+    """
+    Load the per-site extraction rules from a JSON file mapping hostnames to
+    {"content": [selectors], "exclude": [selectors]}. Sites with an invalid selector are skipped.
+    """
+    rules = {}
+    if not os.path.exists(path):
+        return rules
+    try:
+        with open(path, 'r') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading extraction rules from {path}: {e}")
+        return rules
+    for host, site in config.items():
+        try:
+            rules[host.lower()] = SiteRules(host.lower(), site.get('content', []), site.get('exclude', []))
+        except (SelectorError, AttributeError) as e:
+            print(f"Invalid extraction rule for {host}: {e}")
+    return rules
+
+_extraction_rules = None
+_extraction_rules_lock = threading.Lock()
+
+def get_site_rules(url):
+    """
+    Return the extraction rules for the site of a URL, or None. A rule for example.com also applies to
+    www.example.com and other subdomains.
+    """
+    global _extraction_rules
+    with _extraction_rules_lock:
+        if _extraction_rules is None:
+            _extraction_rules = load_extraction_rules()
+    host = (urlparse(url).hostname or '').lower()
+    while host:
+        if host in _extraction_rules:
+            return _extraction_rules[host]
+        host = host.partition('.')[2]
+    return None
+
+def find_main_content(root):
+    """
+    Guess the element holding the article: the first <article>, else the first <main>, else the first
+    <div> with a content or article class, else the whole document.
+    """
+    main = content_div = None
+    for element in root.iter('article', 'main', 'div'):
+        tag = element.tag
+        if tag == 'article':
+            return element
+        if tag == 'main':
+            main = main if main is not None else element
+        elif content_div is None and CONTENT_CLASS_RE.search(element.get('class', '')):
+            content_div = element
+    return next((element for element in (main, content_div) if element is not None), root)
+
+def extract_content_lxml(data, url, keep_image=is_high_quality_image, encoding=None, info=None):
+    """
+    Extract the text and images of an article page with lxml, producing the same list as extract_content_bs4.
+    Sites with extraction rules go straight to their article body with known junk pruned; other pages
+    fall back to find_main_content. The content is then walked once. Images are paired with the caption
+    of their own <figure> rather than the next caption anywhere in the page.
+    If an info dict is given, the page's declared canonical URL is stored in it ('canonical').
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    root = parse_html_bytes(data, encoding)
+
+    canonical = CANONICAL_XPATH(root)
+    if info is not None and canonical:
+        info['canonical'] = canonical[0]
+
+    rules = get_site_rules(url)
+    main_content = rules.find_content(root) if rules else None
+    if main_content is None:
+        main_content = find_main_content(root)
+    if rules:
+        rules.prune(main_content)
+    for element in list(main_content.iter('script', 'style')):
+        if element is not main_content:
+            element.drop_tree()
+
+    content = []
+    current_paragraph = []
+
+    def flush():
+        if current_paragraph:
+            content.append(('text', '\n\n'.join(current_paragraph)))
+            current_paragraph.clear()
+
+    # Depth-first walk keeping the figure each element belongs to; the figure's caption is looked up
+    # the first time one of its images needs it
+    captions = {}
+    stack = [(main_content, None)]
+    while stack:
+        element, figure = stack.pop()
+        tag = element.tag
+        if tag == 'p':
+            flush()
+            text = element.text_content().strip()
+            if text:
+                current_paragraph.append(text)
+        elif tag in HEADING_TAGS:
+            flush()
+            text = element.text_content().strip()
+            if text:
+                content.append(('text', f"\n\n{text}\n"))
+        elif tag == 'img':
+            flush()
+            src = extract_image_url(element, url)
+            alt = element.get('alt', '')
+            caption_text = ''
+            if figure is not None:
+                if figure not in captions:
+                    caption = next(figure.iter('figcaption'), None)
+                    captions[figure] = caption.text_content().strip() if caption is not None else ''
+                caption_text = captions[figure]
+
+            if src and keep_image(src) and (alt or caption_text):
+                content.append(('image', {'url': src, 'alt': alt, 'caption': caption_text}))
+        elif tag == 'figure':
+            figure = element
+        stack.extend((child, figure) for child in reversed(element) if isinstance(child.tag, str))
+
+    flush()
+    return content
+
+def get_header_encoding(response):
+    """
+    Return the charset declared in the Content-Type header, or None.
+    """
+    match = HEADER_CHARSET_RE.search(response.headers.get('Content-Type', ''))
+    return match.group(1) if match else None
+
+def extract_article_all(url, engine=EXTRACTION_ENGINE, raise_errors=False, info=None):
     """
     Extract the main article text and image URLs from a given URL,
     maintaining the relative positioning of images within the text and preserving paragraph structure.
+    Errors are printed and None returned, unless raise_errors is set. info is passed to the extractor.
     """
     try:
         # Fetch the webpage
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+        response = http_client.get(url)
         response.raise_for_status()
-        
-        # Parse the HTML content
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        # Find the main content
-        main_content = soup.find('article') or soup.find('main') or soup.find('div', class_=re.compile('(content|article)'))
-        
-        if not main_content:
-            main_content = soup  # Fallback to entire body if no main content is identified
-        
-        # Extract text and images, maintaining order and paragraph structure
-        content = []
-        current_paragraph = []
-        
-        for element in main_content.descendants:
-            if element.name == 'p':
-                if current_paragraph:
-                    content.append(('text', '\n\n'.join(current_paragraph)))
-                    current_paragraph = []
-                text = element.get_text().strip()
-                if text:
-                    current_paragraph.append(text)
-            elif element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                if current_paragraph:
-                    content.append(('text', '\n\n'.join(current_paragraph)))
-                    current_paragraph = []
-                text = element.get_text().strip()
-                if text:
-                    content.append(('text', f"\n\n{text}\n"))
-            elif element.name == 'img':
-                if current_paragraph:
-                    content.append(('text', '\n\n'.join(current_paragraph)))
-                    current_paragraph = []
-                src = extract_image_url(element, url)
-                alt = element.get('alt', '')
-                caption = element.find_next('figcaption')
-                caption_text = caption.get_text().strip() if caption else ''
-                
-                if src and is_high_quality_image(src) and (alt or caption_text):
-                    content.append(('image', {'url': src, 'alt': alt, 'caption': caption_text}))
-        
-        # Add any remaining paragraph text
-        if current_paragraph:
-            content.append(('text', '\n\n'.join(current_paragraph)))
-        
-        return content
+
+        if engine == 'bs4':
+            return extract_content_bs4(response.text, url, info=info)
+        # Hand lxml the raw bytes; response.text would run charset detection over the whole body
+        return extract_content_lxml(response.content, url, encoding=get_header_encoding(response), info=info)
 
     except requests.RequestException as e:
+        if raise_errors:
+            raise
         print(f"Error fetching or parsing the webpage: {e}")
         return None
-
+    except (etree.ParserError, LookupError) as e:
+        # LookupError: a charset lxml cannot decode
+        if raise_errors:
+            raise
+        print(f"Error parsing the webpage {url}: {e}")
+        return None
 
 
 
@@ -1,51 +1,485 @@
+import hashlib
+from abc import ABC, abstractmethod
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
+import http_client
+from cache import Cache
 
-def summarize_article(text, model="llama3.1:8b"):
+OLLAMA_URL = "http://localhost:11434"
+DEFAULT_MODEL = "llama3.1:8b"
+MAX_IN_FLIGHT = 2  # Concurrent requests sent to Ollama
+CONNECT_TIMEOUT = 5
+REQUEST_TIMEOUT = 300  # Seconds allowed for a whole summary
+CONTEXT_TOKENS = 4096  # Context window requested from the model
+OUTPUT_TOKENS = 512  # Room left in the context for the summary (passed to Ollama as num_predict)
+CHUNK_OVERLAP_TOKENS = 200  # Tokens repeated at the start of the next chunk to keep context
+TEXTRANK_SENTENCES = 5  # Bullet points in an extractive summary
+TEXTRANK_DAMPING = 0.85
+MAX_FAILURES = 3  # Consecutive Ollama failures before the automatic backend stops trying it
+BACKENDS = ['ollama', 'textrank', 'auto']
+KEEP_ALIVE = "30m"  # How long Ollama keeps the model loaded between requests during a run
+KEEP_ALIVE_AFTER_RUN = "5m"  # Ollama's default, restored at the end of a run
+
+# The instructions are sent as a fixed system message, so Ollama can reuse the processed prefix
+# across articles and only the article itself has to be evaluated for each request
+SYSTEM_PROMPT = """You are an AI summarizer. You only summarize articles in bullet points. You do not output any other text. Each bullet point should be a single sentence. Do not use nested bullet points or subpoints. Start each bullet point with a dash (-) followed by a space.
+Only consider the text provided by the user and nothing else."""
+
+PROMPT_TEMPLATE = """ARTICLE TEXT:
+{text}
+
+SUMMARY:"""
+
+CHUNK_PROMPT_TEMPLATE = """The text below is part {part} of {parts} of a longer article. Summarize only this part.
+
+ARTICLE PART:
+{text}
+
+SUMMARY:"""
+
+MERGE_PROMPT_TEMPLATE = """The bullet points below summarize consecutive parts of one article. Merge them into a single summary of the whole article, removing repetitions.
+
+PARTIAL SUMMARIES:
+{text}
+
+SUMMARY:"""
+
+# Summaries keyed by a hash of the article text, model and prompt template
+summary_cache = Cache('summaries', ttl=30 * 24 * 3600, max_size=50 * 1024 * 1024)
+
+def summary_cache_key(text, model, template=PROMPT_TEMPLATE):
+    digest = hashlib.sha256()
+    for part in (model, SYSTEM_PROMPT, template, text):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def estimate_tokens(text):
     """
-    Summarize the given article text using Ollama.
-    
-    :param text: The article text to summarize
-    :param model: The Ollama model to use (default: "llama2:8b")
-    :return: A bullet-point summary of the article
+    Conservatively estimate the number of model tokens in a text (about three characters per token).
     """
-    prompt = f"""INSTRUCTION: You are an AI summarizer. You only summarize articles in bullet points. You do not output any other text. Each bullet point should be a single sentence. Do not use nested bullet points or subpoints. Start each bullet point with a dash (-) followed by a space.
-    Only consider the article text provided below and nothing else. 
+    return len(text) // 3 + 1
 
-    ARTICLE TEXT:
-    {text}
+def chunk_budget(context_tokens=CONTEXT_TOKENS, output_tokens=OUTPUT_TOKENS):
+    """
+    Return the number of article tokens that fit in one request: the context window minus the
+    system prompt, the longest prompt template and the room reserved for the reply.
+    """
+    prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + max(
+        estimate_tokens(template.format(text='', part=99, parts=99))
+        for template in (PROMPT_TEMPLATE, CHUNK_PROMPT_TEMPLATE, MERGE_PROMPT_TEMPLATE))
+    budget = context_tokens - prompt_tokens - output_tokens
+    if budget <= 2 * CHUNK_OVERLAP_TOKENS:
+        raise ValueError(f"A context of {context_tokens} tokens leaves no room for the article with {output_tokens} output tokens")
+    return budget
 
-    SUMMARY:"""
+def split_sentences(text):
+    return [sentence for sentence in re.split(r'(?<=[.!?])\s+|\n+', text) if sentence.strip()]
 
-    # prompt = f"""INSTRUCTION: Summarize the following article in 3-5 bullet points. 
-    # Each bullet point should be a single sentence. Do not use nested bullet points or sub-points. 
-    # Start each bullet point with a dash (-) followed by a space.
-    # Only consider the article text provided below and nothing else.
+def chunk_text(text, max_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Split a text into chunks of at most max_tokens, cutting at sentence boundaries.
+    Each chunk starts with the last sentences of the previous one, up to overlap_tokens.
+    """
+    sentences = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) <= max_tokens:
+            sentences.append(sentence)
+            continue
+        # A single sentence longer than a chunk is cut by words
+        words = sentence.split()
+        step = max(1, max_tokens // 2)  # Words of about six characters
+        sentences.extend(' '.join(words[i:i + step]) for i in range(0, len(words), step))
 
-    # ARTICLE TEXT:
-    # {text}
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence in sentences:
+        tokens = estimate_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(' '.join(current))
+            # Carry the tail of this chunk over to the next one
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                overlap_size += estimate_tokens(previous)
+                if overlap_size > overlap_tokens or overlap_size + tokens > max_tokens:
+                    break
+                overlap.insert(0, previous)
+            current = overlap
+            current_tokens = sum(estimate_tokens(previous) for previous in current)
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+class SummarizerError(Exception):
+    """
+    Raised when a summarization request times out, is cancelled or gets a malformed response.
+    """
+
+class SummarizerBackend(ABC):
+    """
+    Base class for summarizer backends. A backend turns an article text into a dash-bullet summary
+    (or None on failure) and keeps counts of its work for the run report.
+    """
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'errors': 0, 'cache_hits': 0, 'fallbacks': 0, 'tokens': 0, 'seconds': 0.0,
+                       'prompt_tokens': 0, 'load_seconds': 0.0, 'prompt_seconds': 0.0}
+
+    @abstractmethod
+    def summarize(self, text):
+        """
+        Return a dash-bullet summary of text, or None on failure.
+        """
+
+    def warm_up(self):
+        """
+        Prepare the backend before the first article arrives.
+        """
+
+    def release(self):
+        """
+        Free resources held for the duration of the run.
+        """
+
+    def _record(self, **counts):
+        with self._stats_lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def stats(self):
+        """
+        Return the request, cache and token counts so far, including the generation speed.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['tokens_per_second'] = stats['tokens'] / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+
+    def summarize_many(self, texts):
+        """
+        Summarize several texts concurrently, keeping the backend's request slots busy.
+        Returns the summaries in the same order as the texts.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            return list(executor.map(self.summarize, texts))
+
+class SummaryEngine(SummarizerBackend):
+    """
+    Summarize articles with Ollama, keeping at most max_in_flight requests running at once.
+    Responses are streamed so that each request can be stopped when it runs past its timeout
+    or when the engine is cancelled. Throughput is recorded in tokens per second.
+    """
+    def __init__(self, model=DEFAULT_MODEL, base_url=OLLAMA_URL, max_in_flight=MAX_IN_FLIGHT, timeout=REQUEST_TIMEOUT,
+                 context_tokens=CONTEXT_TOKENS, output_tokens=OUTPUT_TOKENS, keep_alive=KEEP_ALIVE):
+        super().__init__(max_in_flight)
+        self.model = model
+        self.context_tokens = context_tokens
+        self.output_tokens = output_tokens
+        # Longer articles are split into chunks that fit in the context next to the prompt and the reply
+        self.chunk_tokens = chunk_budget(context_tokens, output_tokens)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._cancelled = threading.Event()
+        self.timings = []  # Load, prefill and generation durations of each request, in seconds
+        self.warm_up_timing = None  # The same for the warm-up request, which is not counted as a summary
+
+    def cancel(self):
+        """
+        Stop all in-flight requests and refuse new ones.
+        """
+        self._cancelled.set()
+
+    def chat(self, content, options=None, warm_up=False):
+        """
+        Send an article (or other user message) after the fixed system prompt and return the streamed reply.
+        With warm_up, the request's timings are kept apart from the summary statistics.
+        Raises SummarizerError on timeout, cancellation or a truncated reply, and requests.RequestException on HTTP errors.
+        """
+        with self._slots:
+            if self._cancelled.is_set():
+                raise SummarizerError("Summarization cancelled")
+            deadline = time.monotonic() + self.timeout
+            started = time.monotonic()
+            response = http_client.post(
+                f"{self.base_url}/api/chat",
+                json={
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": content}
+                    ],
+                    "stream": True,
+                    "keep_alive": self.keep_alive,
+                    "options": {"num_ctx": self.context_tokens, "num_predict": self.output_tokens, **(options or {})}
+                },
+                timeout=(CONNECT_TIMEOUT, self.timeout),
+                stream=True
+            )
+            with response:
+                response.raise_for_status()
+                pieces = []
+                tokens = 0
+                final = {}
+                for line in response.iter_lines():
+                    if self._cancelled.is_set():
+                        raise SummarizerError("Summarization cancelled")
+                    if time.monotonic() > deadline:
+                        raise SummarizerError(f"Summarization timed out after {self.timeout} seconds")
+                    if not line:
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError as e:
+                        raise SummarizerError(f"Malformed response from Ollama: {e}")
+                    if 'error' in chunk:
+                        raise SummarizerError(f"Ollama error: {chunk['error']}")
+                    pieces.append(chunk.get('message', {}).get('content', ''))
+                    tokens += 1
+                    if chunk.get('done'):
+                        final = chunk
+                        break
+                if not final:
+                    # The stream ended early, so the text is partial and must not be cached
+                    raise SummarizerError("Ollama response ended before completion")
+
+            self._record_timings(final, tokens, time.monotonic() - started, warm_up)
+            return ''.join(pieces)
+
+    def _record_timings(self, final, tokens, elapsed, warm_up=False):
+        # Ollama reports token counts and durations (in nanoseconds) in the last chunk
+        timing = {
+            'load': final.get('load_duration', 0) / 1e9,
+            'prompt_tokens': final.get('prompt_eval_count', 0),
+            'prompt_eval': final.get('prompt_eval_duration', 0) / 1e9,
+            'eval_tokens': final.get('eval_count', tokens),
+            'eval': final.get('eval_duration', 0) / 1e9 or elapsed,
+        }
+        if warm_up:
+            self.warm_up_timing = timing
+            return
+        with self._stats_lock:
+            self.timings.append(timing)
+        self._record(requests=1, tokens=timing['eval_tokens'], seconds=timing['eval'], prompt_tokens=timing['prompt_tokens'],
+                     load_seconds=timing['load'], prompt_seconds=timing['prompt_eval'])
+
+    def warm_up(self):
+        """
+        Load the model and process the system prompt once before the first article, so the first
+        summaries neither pay the model load nor the prefill of the shared instructions.
+        """
+        started = time.monotonic()
+        try:
+            self.chat("Reply with OK.", options={"num_predict": 1}, warm_up=True)
+            print(f"Summarizer warmed up in {time.monotonic() - started:.1f}s (model load {self.warm_up_timing['load']:.1f}s)")
+        except (requests.RequestException, SummarizerError) as e:
+            print(f"Error while warming up the summarizer: {e}")
+
+    def release(self):
+        """
+        Restore Ollama's usual keep-alive for the model now that the run is over.
+        """
+        try:
+            http_client.post(
+                f"{self.base_url}/api/generate",
+                json={"model": self.model, "keep_alive": KEEP_ALIVE_AFTER_RUN},
+                timeout=(CONNECT_TIMEOUT, 30)
+            ).close()
+        except requests.RequestException as e:
+            print(f"Error while releasing the summarizer model: {e}")
+
+    def summarize(self, text):
+        """
+        Summarize the given article text, using the summary cache when possible.
+        Articles longer than one chunk are summarized chunk by chunk, concurrently, and the partial
+        summaries are then merged. Returns a bullet-point summary, or None if a request failed.
+        """
+        long_article = estimate_tokens(text) > self.chunk_tokens
+        template = PROMPT_TEMPLATE + CHUNK_PROMPT_TEMPLATE + MERGE_PROMPT_TEMPLATE if long_article else PROMPT_TEMPLATE
+        key = summary_cache_key(text, self.model, template)
+        cached = summary_cache.get(key)
+        if cached is not None:
+            self._record(cache_hits=1)
+            return cached
+
+        try:
+            if long_article:
+                summary = self.summarize_chunks(text)
+            else:
+                summary = self.chat(PROMPT_TEMPLATE.format(text=text)).strip()
+        except (requests.RequestException, SummarizerError) as e:
+            self._record(errors=1)
+            print(f"Error while summarizing article: {e}")
+            return None
 
-    # SUMMARY:"""
-    
-    try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            }
-        )
-        response.raise_for_status()
-        result = response.json()
-        summary = result['response'].strip()
-        
         # Ensure the summary is in the correct format
         formatted_summary = format_bullet_points(summary)
-        
+        summary_cache.set(key, formatted_summary)
         return formatted_summary
-    except requests.RequestException as e:
-        print(f"Error while summarizing article: {e}")
-        return None
+
+    def summarize_chunks(self, text):
+        """
+        Map-reduce summary of a long text: summarize its chunks concurrently, then merge the partial
+        bullet lists, in several rounds if they do not fit in one request.
+        """
+        chunks = chunk_text(text, self.chunk_tokens)
+        prompts = [CHUNK_PROMPT_TEMPLATE.format(part=i + 1, parts=len(chunks), text=chunk) for i, chunk in enumerate(chunks)]
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            partials = [format_bullet_points(partial.strip()) for partial in executor.map(self.chat, prompts)]
+
+        while True:
+            # Group consecutive partial summaries into merge requests that fit in a chunk
+            groups = [[]]
+            for partial in partials:
+                if groups[-1] and estimate_tokens('\n'.join(groups[-1] + [partial])) > self.chunk_tokens:
+                    groups.append([])
+                groups[-1].append(partial)
+            if len(groups) == len(partials):
+                # No two summaries fit together; merge them all at once rather than loop
+                groups = [partials]
+            prompts = [MERGE_PROMPT_TEMPLATE.format(text='\n'.join(group)) for group in groups]
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+                partials = [format_bullet_points(partial.strip()) for partial in executor.map(self.chat, prompts)]
+            if len(partials) == 1:
+                return partials[0]
+
+def textrank(text, sentence_count=TEXTRANK_SENTENCES, damping=TEXTRANK_DAMPING):
+    """
+    Extractive summary: rank the sentences of a text with PageRank over their TF-IDF cosine
+    similarity and return the best ones in their original order, as dash bullet points.
+    """
+    sentences = [sentence.strip() for sentence in split_sentences(text) if len(sentence.split()) >= 4]
+    if len(sentences) <= sentence_count:
+        return '\n'.join(f"- {sentence}" for sentence in sentences)
+
+    # Sentence x term count matrix
+    vocabulary = {}
+    rows, columns = [], []
+    for row, sentence in enumerate(sentences):
+        for word in re.findall(r'\w+', sentence.lower()):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(word, len(vocabulary)))
+    counts = np.zeros((len(sentences), len(vocabulary)))
+    np.add.at(counts, (rows, columns), 1)
+
+    # TF-IDF rows normalized to unit length, so the dot product is the cosine similarity
+    document_frequency = np.count_nonzero(counts, axis=0)
+    vectors = counts * (np.log(len(sentences) / document_frequency) + 1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0)
+
+    # PageRank by power iteration; sentences similar to no other one link to all of them
+    totals = similarity.sum(axis=1, keepdims=True)
+    transition = np.divide(similarity, totals, out=np.full_like(similarity, 1 / len(sentences)), where=totals > 0)
+    scores = np.full(len(sentences), 1 / len(sentences))
+    for _ in range(100):
+        updated = (1 - damping) / len(sentences) + damping * (transition.T @ scores)
+        converged = np.abs(updated - scores).sum() < 1e-6
+        scores = updated
+        if converged:
+            break
+
+    best = sorted(np.argsort(-scores, kind='stable')[:sentence_count])
+    return '\n'.join(f"- {sentences[index]}" for index in best)
+
+class TextRankSummarizer(SummarizerBackend):
+    """
+    CPU-cheap extractive summaries with TextRank, for machines without a warm LLM.
+    """
+    def __init__(self, sentence_count=TEXTRANK_SENTENCES, max_in_flight=MAX_IN_FLIGHT):
+        super().__init__(max_in_flight)
+        self.sentence_count = sentence_count
+
+    def summarize(self, text):
+        started = time.monotonic()
+        summary = textrank(text, self.sentence_count)
+        self._record(requests=1, seconds=time.monotonic() - started)
+        return summary or None
+
+class FallbackSummarizer(SummarizerBackend):
+    """
+    Use the primary backend, and the fallback one for articles it fails to summarize.
+    After max_failures consecutive failures (Ollama unreachable or too slow), the primary is skipped
+    for the rest of the run.
+    """
+    def __init__(self, primary, fallback, max_failures=MAX_FAILURES):
+        super().__init__(primary.max_in_flight)
+        self.primary = primary
+        self.fallback = fallback
+        self.max_failures = max_failures
+        self._failures = 0
+
+    def summarize(self, text):
+        if self._failures < self.max_failures:
+            summary = self.primary.summarize(text)
+            with self._stats_lock:
+                if summary is not None:
+                    self._failures = 0
+                    return summary
+                self._failures += 1
+                if self._failures == self.max_failures:
+                    print("Summarizer: primary backend keeps failing, using the fallback for the rest of the run")
+        self._record(fallbacks=1)
+        return self.fallback.summarize(text)
+
+    def warm_up(self):
+        self.primary.warm_up()
+
+    def release(self):
+        self.primary.release()
+
+    def stats(self):
+        stats = self.primary.stats()
+        stats['fallbacks'] = super().stats()['fallbacks']
+        return stats
+
+def create_summarizer(backend='ollama', model=DEFAULT_MODEL, **options):
+    """
+    Create a summarizer backend by name: "ollama", "textrank", or "auto" (Ollama with TextRank as fallback).
+    options are passed to the Ollama engine.
+    """
+    if backend == 'textrank':
+        return TextRankSummarizer()
+    engine = SummaryEngine(model, **options)
+    if backend == 'auto':
+        return FallbackSummarizer(engine, TextRankSummarizer(max_in_flight=engine.max_in_flight))
+    return engine
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(model=DEFAULT_MODEL):
+    """
+    Return a shared SummaryEngine for the given model with the default settings.
+    """
+    with _engines_lock:
+        if model not in _engines:
+            _engines[model] = SummaryEngine(model)
+        return _engines[model]
+
+def summarize_article(text, model=DEFAULT_MODEL):
+    """
+    Summarize the given article text using Ollama.
+    Summaries are cached, so only new or changed articles reach the model.
+    
+    :param text: The article text to summarize
+    :param model: The Ollama model to use (default: "llama3.1:8b")
+    :return: A bullet-point summary of the article
+    """
+    return get_engine(model).summarize(text)
 
 def format_bullet_points(text):
     """
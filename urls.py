@@ -0,0 +1,79 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, urljoin
+from cache import Cache
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    'cmp', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'ito', 'ref', 'ref_src',
+    'int_source', 'int_medium', 'int_campaign', 'ssm', 'intcmp', 'at_medium', 'at_campaign',
+    'ns_mchannel', 'ns_source', 'ns_campaign', 'ns_linkname', 'ns_fee', 'ocid',
+}
+TRACKING_PREFIXES = ('utm_', 'at_', 'ga_', 'pk_', 'mtm_', 'hsa_', 'oly_')
+# Second-level labels under country TLDs that are public suffixes themselves (bbc.co.uk, abc.net.au)
+SECOND_LEVEL_LABELS = {'co', 'com', 'net', 'org', 'gov', 'gob', 'edu', 'ac', 'or', 'ne', 'go'}
+
+# Canonical URL declared by an article page (<link rel="canonical">), keyed by normalized article URL
+canonical_cache = Cache('canonical_urls', ttl=30 * 24 * 3600)
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def normalize_url(url):
+    """
+    Normalize a URL so that variants of the same article compare equal:
+    https scheme, lowercase host without "www.", no default port, fragment or trailing slash,
+    tracking parameters removed and the remaining query parameters sorted.
+    """
+    if not url:
+        return url
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if not is_tracking_param(name))
+    return urlunsplit(('https', host, path, urlencode(query), ''))
+
+def registrable_domain(host):
+    """
+    Return the domain a host belongs to (news.bbc.co.uk -> bbc.co.uk), approximating the public suffix list.
+    """
+    labels = (host or '').lower().split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+def canonicalize_url(url):
+    """
+    Return the canonical form of an article URL, using the page's declared canonical URL when known.
+    """
+    normalized = normalize_url(url)
+    canonical = canonical_cache.get(normalized)
+    # Entries saved before canonicals were checked may still point to a home page
+    return canonical if canonical and is_article_canonical(normalized, canonical) else normalized
+
+def is_article_canonical(url, canonical):
+    """
+    Whether a normalized canonical URL can stand for the article at url: same site, and not its home page.
+    """
+    parts = urlsplit(canonical)
+    return parts.path not in ('', '/') and registrable_domain(parts.hostname) == registrable_domain(urlsplit(url).hostname)
+
+def remember_canonical(url, canonical):
+    """
+    Record the <link rel="canonical"> of a page so later lookups of url resolve to it.
+    Canonicals pointing to a home page or to another site are ignored: consent, paywall and
+    interstitial pages often declare the site root, which would merge every article of the site.
+    """
+    if not canonical or not url:
+        return
+    normalized = normalize_url(url)
+    canonical = normalize_url(urljoin(url, canonical))
+    if not is_article_canonical(normalized, canonical):
+        return
+    if canonical != normalized and canonical_cache.get(normalized) != canonical:
+        canonical_cache.set(normalized, canonical)